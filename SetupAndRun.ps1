@@ -50,6 +50,15 @@ if ($LastExitCode -ne 0) {
 
 Write-Output "Dependencies installed."
 
+# Convert the CSV files into the columnar cache (skipped for files that did not change)
+Write-Output "Ingesting data..."
+& "$envName/Scripts/python.exe" -m core.store
+
+if ($LastExitCode -ne 0) {
+    Write-Error "Failed to ingest data."
+    exit 1
+}
+
 # Start the Streamlit app
 Write-Output "Starting the app..."
 & "$envName/Scripts/python.exe" -m streamlit run main.py
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+import streamlit.config
+import streamlit.logger
+
+from benchmarks.synthetic_data import TEMPLATE_PATH, write_synthetic_csv
+from core.backtest import BACKTEST_WORKERS
+from core.cube import REQUIRED_POLLUTANTS, open_cube
+from core.forecasters import DEFAULT_ENGINE
+from core.rollups import build_rollups
+from core.store import append_csv, ensure_store, open_store, store_path
+from core.window_stats import build_window_stats
+from tabs.forecasting_tab import build_forecasting_tab, get_job_queue
+from tabs.general_tab import build_general_tab
+from tabs.humidity_and_temp_tab import build_humidity_and_temp_tab
+from tabs.insights_tab_v2 import build_insights_tab
+from tabs.profiling import RerunProfile
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# Copies of the template cities x multiples of its history; rows grow by the product
+SCALES = {
+    '1x': (1, 1),
+    '10x': (5, 2),
+    '100x': (20, 5),
+}
+
+# A stage regresses when it is this much slower or larger than its baseline, and the
+# difference is above the noise floor
+TOLERANCE = 0.25
+MIN_SECONDS = 0.05
+MIN_BYTES = 1 << 20
+
+
+def split_last_day(csv_path, delta_path):
+    # Hold the last day back so the incremental append is measured as well
+    rows = pd.read_csv(csv_path)
+    last_day = rows['Date'] == rows['Date'].max()
+    rows[~last_day].to_csv(csv_path, index=False)
+    rows[last_day].to_csv(delta_path, index=False)
+    return len(rows)
+
+
+def run_stages(csv_path, delta_path, engine=DEFAULT_ENGINE):
+    # Every stage of a dashboard load, from CSV ingest to each tab, with Streamlit calls running bare
+    profile = RerunProfile(cprofile=False)
+    # The dashboard starts its fit workers on its first run, and they are ready long before the
+    # Forecasting tab is opened. Waiting for them here keeps their start-up out of the stages, as the
+    # libraries they import were when the fits ran in this process. Workers keep the directory they
+    # were spawned in, so each scale gets a fresh pool.
+    get_job_queue(BACKTEST_WORKERS).ready()
+    with profile.section("ingest"):
+        ensure_store(csv_path)
+    with profile.section("append"):
+        append_csv(csv_path, delta_path)
+    with profile.section("open_cube"):
+        cube = open_cube(store_path(csv_path))
+    with profile.section("build_rollups"):
+        build_rollups(cube.cities, cube.dates, cube.species, cube.values, cube.api)
+    with profile.section("build_window_stats"):
+        window_stats = build_window_stats(open_store(store_path(csv_path)), cube)
+
+    cities = list(cube.cities)
+    selected_city = cities[0]
+    regressors = [specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS]
+    selected_regressor = 'temperature' if 'temperature' in regressors else regressors[0]
+    with profile.section("tab.general"):
+        build_general_tab(cube, cities, window_stats, (cube.dates[0].date(), cube.dates[-1].date()))
+    with profile.section("tab.city"):
+        build_humidity_and_temp_tab(cube, selected_city)
+    with profile.section("tab.insights"):
+        build_insights_tab(cube, cities, selected_city)
+    with profile.section("tab.forecasting"):
+        # The fits run in the background job queue; render again once they have finished
+        build_forecasting_tab(cube, selected_city, 30, selected_regressor, engine)
+        get_job_queue(BACKTEST_WORKERS).wait()
+        build_forecasting_tab(cube, selected_city, 30, selected_regressor, engine)
+    get_job_queue(BACKTEST_WORKERS).shutdown()
+    get_job_queue.clear()
+    return {
+        record['section']: {key: record[key] for key in ('wall_seconds', 'cpu_seconds', 'peak_bytes')}
+        for record in profile.sections
+    }
+
+
+def run_scale(scale, template_path, engine=DEFAULT_ENGINE, seed=0):
+    # Runs in a scratch directory so the store, model cache and results store start empty
+    city_factor, year_factor = SCALES[scale]
+    workdir = tempfile.mkdtemp(prefix=f"airquality-bench-{scale}-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        csv_path = os.path.join("data", "synthetic.csv")
+        delta_path = os.path.join("data", "synthetic_delta.csv")
+        write_synthetic_csv(csv_path, city_factor, year_factor, template_path, seed)
+        rows = split_last_day(csv_path, delta_path)
+        return {'rows': rows, 'stages': run_stages(csv_path, delta_path, engine)}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def regressions(result, baseline, tolerance=TOLERANCE):
+    # (stage, metric, baseline, current) for every stage slower or larger than its baseline allows
+    found = []
+    for stage, metrics in result['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None:
+            continue
+        for metric, floor in (('wall_seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+            if metrics[metric] > reference[metric] * (1 + tolerance) and metrics[metric] - reference[metric] > floor:
+                found.append((stage, metric, reference[metric], metrics[metric]))
+    return found
+
+
+def load_baselines(path=BASELINES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_result(scale, result):
+    print(f"\n{scale}: {result['rows']} rows")
+    for stage, metrics in result['stages'].items():
+        print(f"  {stage:<18} {metrics['wall_seconds']:8.2f} s wall {metrics['cpu_seconds']:8.2f} s CPU "
+              f"{metrics['peak_bytes'] / 2 ** 20:9.1f} MB peak")
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.run_benchmarks [--scales 1x,10x,100x] [--save-baseline]
+    parser = argparse.ArgumentParser(description="Time every dashboard stage on synthetic data and compare with the baselines.")
+    parser.add_argument("--scales", default="1x,10x", help=f"comma-separated scales out of {', '.join(SCALES)}")
+    parser.add_argument("--template", default=TEMPLATE_PATH)
+    parser.add_argument("--engine", default=DEFAULT_ENGINE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baselines")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Streamlit calls run without a session; silence the warning each one logs. Reading an option
+    # parses the config first, which would otherwise reset the level
+    streamlit.config.get_option("logger.level")
+    streamlit.logger.set_log_level("error")
+
+    template_path = os.path.abspath(args.template)
+    baselines = load_baselines()
+    results = {}
+    failed = False
+    for scale in args.scales.split(","):
+        results[scale] = run_scale(scale, template_path, args.engine)
+        print_result(scale, results[scale])
+        if scale in baselines and not args.save_baseline:
+            for stage, metric, reference, current in regressions(results[scale], baselines[scale], args.tolerance):
+                failed = True
+                print(f"  REGRESSION {stage} {metric}: {reference:.3g} -> {current:.3g}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump({**baselines, **results}, f, indent=2)
+        print(f"\nBaselines saved to {BASELINES_PATH}")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import TEMPLATE_PATH, write_synthetic_csv
+from core.store import DASHBOARD_DATA, DASHBOARD_FILTERS, ensure_store
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(REPO_DIR, "main.py")
+# Seconds from a fresh interpreter to the first page rendered (the General tab, store already
+# ingested); AIRQUALITY_STARTUP_BUDGET overrides it on slower hosts. About 2 s on a single core with
+# every heavy import deferred, 4.7 s without
+STARTUP_BUDGET = float(os.environ.get("AIRQUALITY_STARTUP_BUDGET", "3.5"))
+# Libraries only the forecast fits use. Importing any of them before the first page renders means a
+# module-level import crept back into a module main.py loads.
+DEFERRED_MODULES = ('prophet', 'cmdstanpy', 'sklearn', 'statsmodels', 'scipy', 'matplotlib')
+
+# Runs in the fresh interpreter: render main.py once, then report on stdout
+FIRST_RENDER = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=600)
+app.run()
+print(json.dumps({
+    'render_seconds': time.perf_counter() - started,
+    'exceptions': [exception.value for exception in app.exception],
+    'modules': sorted(sys.modules),
+}))
+"""
+
+
+def import_times(importtime_log):
+    # {module: cumulative seconds} of the imports no other import triggered, from python -X importtime
+    found = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit() or name.startswith("  "):
+            continue
+        found[name.strip()] = found.get(name.strip(), 0) + int(cumulative) / 1e6
+    return found
+
+
+def child_environment():
+    # Environment of a fresh interpreter that imports the dashboard's modules from this checkout
+    return {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')]))}
+
+
+def cold_start(workdir):
+    # One fresh interpreter rendering the first page: wall seconds from launch, the run's report
+    # and its top-level import times
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", FIRST_RENDER, MAIN_PATH], cwd=workdir, capture_output=True, text=True,
+        env=child_environment(),
+    )
+    seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"First render failed:\n{completed.stderr[-2000:]}")
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    return seconds, report, import_times(completed.stderr)
+
+
+def measure_startup(template_path, runs=3, seed=0):
+    # Median cold start over runs, in a scratch directory whose store is ingested beforehand so
+    # the runs time the start of the dashboard, not the ingest (run_benchmarks times that)
+    workdir = tempfile.mkdtemp(prefix="airquality-startup-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        write_synthetic_csv(DASHBOARD_DATA, template_path=template_path, seed=seed)
+        ensure_store(DASHBOARD_DATA, DASHBOARD_FILTERS)
+        samples = [cold_start(workdir) for _ in range(max(1, runs))]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    _, report, imports = samples[-1]
+    return {
+        'startup_seconds': statistics.median(sample[0] for sample in samples),
+        'render_seconds': statistics.median(sample[1]['render_seconds'] for sample in samples),
+        'exceptions': report['exceptions'],
+        'deferred_loaded': sorted({
+            module.split('.')[0] for module in report['modules'] if module.split('.')[0] in DEFERRED_MODULES
+        }),
+        'imports': dict(sorted(imports.items(), key=lambda item: -item[1])),
+    }
+
+
+def print_startup(result, top=15):
+    print("Slowest top-level imports:")
+    for module, seconds in list(result['imports'].items())[:top]:
+        print(f"  {module:<40} {seconds:8.3f} s")
+    print(f"First render {result['render_seconds']:.2f} s; cold start {result['startup_seconds']:.2f} s from launch")
+    if result['deferred_loaded']:
+        print(f"Loaded before the first render: {', '.join(result['deferred_loaded'])}")
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.startup [--runs 3] [--budget 3.5] [--output startup.json]
+    parser = argparse.ArgumentParser(description="Time the cold start of the dashboard and check it against a budget.")
+    parser.add_argument("--template", default=TEMPLATE_PATH)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="seconds from launch to the first render")
+    parser.add_argument("--top", type=int, default=15, help="top-level imports listed")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    result = measure_startup(os.path.abspath(args.template), args.runs)
+    print_startup(result, args.top)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    failed = False
+    if result['exceptions']:
+        failed = True
+        print("FAILED first render raised:\n  " + "\n  ".join(result['exceptions']))
+    if result['deferred_loaded']:
+        failed = True
+        print(f"FAILED {', '.join(result['deferred_loaded'])} must only be imported by the forecast fits")
+    if result['startup_seconds'] > args.budget:
+        failed = True
+        print(f"FAILED cold start {result['startup_seconds']:.2f} s is over the {args.budget:.2f} s budget")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,84 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.store import CSV_COLUMNS
+
+TEMPLATE_PATH = os.path.join("data", "romania_data.csv")
+
+
+def template_profile(template: DataFrame):
+    # Per city and species: how often a day is reported and the typical level, spread and count
+    template = template.copy()
+    template['Date'] = pd.to_datetime(template['Date'])
+    days = template['Date'].nunique()
+    grouped = template.groupby(['City', 'Specie'])
+    profile = pd.DataFrame({
+        'coverage': grouped['Date'].nunique() / days,
+        'mean': grouped['median'].mean(),
+        'std': grouped['median'].std().fillna(0),
+        'low': (template['median'] - template['min']).groupby([template['City'], template['Specie']]).mean(),
+        'high': (template['max'] - template['median']).groupby([template['City'], template['Specie']]).mean(),
+        'count': grouped['count'].mean().round(),
+        'variance': grouped['variance'].mean(),
+        'non_negative': grouped['min'].min() >= 0,
+        'country': grouped['Country'].first(),
+    }).reset_index()
+    return profile, template['Date'].min(), template['Date'].max()
+
+
+def synthetic_rows(template: DataFrame, city_factor=1, year_factor=1, seed=0) -> DataFrame:
+    # Every template city is copied city_factor times and its history extended year_factor times
+    # back in time, with a yearly cycle plus noise around the template level of each species
+    rng = np.random.default_rng(seed)
+    profile, start, end = template_profile(template)
+    dates = pd.date_range(end=end, periods=((end - start).days + 1) * year_factor, freq='D')
+    day_of_year = dates.dayofyear.to_numpy()
+
+    frames = []
+    for copy in range(city_factor):
+        suffix = "" if copy == 0 else f" {copy + 1}"
+        for pair in profile.itertuples(index=False):
+            observed = rng.random(len(dates)) < pair.coverage
+            n = int(observed.sum())
+            cycle = np.cos(2 * np.pi * (day_of_year[observed] - 15) / 365.25)
+            median = pair.mean + pair.std * (0.7 * cycle + 0.7 * rng.standard_normal(n))
+            if pair.non_negative:
+                median = np.maximum(median, 0)
+            low = np.abs(pair.low * rng.gamma(2.0, 0.5, n))
+            high = np.abs(pair.high * rng.gamma(2.0, 0.5, n))
+            frames.append(pd.DataFrame({
+                'Date': dates[observed].strftime('%Y-%m-%d'),
+                'Country': pair.country,
+                'City': pair.City + suffix,
+                'Specie': pair.Specie,
+                'count': np.full(n, max(int(pair.count), 1)),
+                'min': (median - low).round(1),
+                'max': (median + high).round(1),
+                'median': median.round(1),
+                'variance': (pair.variance * rng.gamma(2.0, 0.5, n)).round(2),
+            }))
+    return pd.concat(frames, ignore_index=True)[CSV_COLUMNS]
+
+
+def write_synthetic_csv(path, city_factor=1, year_factor=1, template_path=TEMPLATE_PATH, seed=0):
+    rows = synthetic_rows(pd.read_csv(template_path), city_factor, year_factor, seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows.to_csv(path, index=False)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic air quality CSV in the romania_data.csv schema.")
+    parser.add_argument("output")
+    parser.add_argument("--cities", type=int, default=10, help="copies of every template city")
+    parser.add_argument("--years", type=int, default=1, help="multiples of the template history")
+    parser.add_argument("--template", default=TEMPLATE_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = write_synthetic_csv(args.output, args.cities, args.years, args.template, args.seed)
+    print(f"{args.output}: {rows} rows")
@@ -0,0 +1,142 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.cube import open_cube
+from core.forecast import forecast_input
+from core.forecasters import FORECASTERS, GLOBAL_ENGINE, prophet_fit_predict
+from core.global_forecast import GlobalForecaster, city_fit_predict, global_panel
+from core.store import DASHBOARD_DATA, DASHBOARD_FILTERS, country_filters, ensure_store
+
+# Worker processes for backtest fits; set BACKTEST_WORKERS to override the CPU count
+BACKTEST_WORKERS = int(os.environ.get("BACKTEST_WORKERS", os.cpu_count() or 1))
+
+
+def rolling_origin_cutoffs(n_rows, horizon, stride, initial):
+    # Row positions where training ends; every fold keeps at least one test row
+    return list(range(initial, n_rows, stride)) if initial < n_rows else []
+
+
+def evaluate_fold(data: DataFrame, cutoff, horizon, selected_regressor, fit_predict):
+    train = data.iloc[:cutoff]
+    test = data.iloc[cutoff:cutoff + horizon]
+
+    # The regressor is unknown after the cutoff, so it is held at its last training value
+    future = test[['ds']].copy()
+    future[selected_regressor] = train[selected_regressor].iloc[-1]
+    predicted = np.full(horizon, np.nan)
+    started = time.perf_counter()
+    predicted[:len(test)] = fit_predict(train, future, selected_regressor)
+    fit_seconds = time.perf_counter() - started
+    actual = np.full(horizon, np.nan)
+    actual[:len(test)] = test['y'].to_numpy()
+    return actual, predicted, fit_seconds
+
+
+def horizon_metrics(actual, predicted):
+    # MAE, MAPE and RMSE per horizon step, computed over all folds at once; arrays are (folds, horizon)
+    error = predicted - actual
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage_error = np.where(actual != 0, np.abs(error) / np.abs(actual), np.nan)
+        metrics = pd.DataFrame({
+            'step': np.arange(1, actual.shape[1] + 1),
+            'folds': np.sum(~np.isnan(error), axis=0),
+            'MAE': np.nanmean(np.abs(error), axis=0),
+            'MAPE': np.nanmean(percentage_error, axis=0) * 100,
+            'RMSE': np.sqrt(np.nanmean(error ** 2, axis=0)),
+        })
+    return metrics
+
+
+def rolling_origin_evaluation(data: DataFrame, horizon, selected_regressor, stride=7, initial=None,
+                              fit_predict=prophet_fit_predict, executor=None):
+    # Evaluate many cutoffs: train on everything before each cutoff, predict the next `horizon` rows
+    data = data.sort_values(by='ds').reset_index(drop=True)
+    initial = max(horizon, len(data) // 2) if initial is None else initial
+    cutoffs = rolling_origin_cutoffs(len(data), horizon, stride, initial)
+    if not cutoffs:
+        raise ValueError(f"Not enough data for a rolling-origin evaluation: {len(data)} rows, {initial} initial")
+
+    # Folds are independent fits, so they run side by side when an executor is given
+    if executor is None:
+        results = [evaluate_fold(data, cutoff, horizon, selected_regressor, fit_predict) for cutoff in cutoffs]
+    else:
+        futures = [executor.submit(evaluate_fold, data, cutoff, horizon, selected_regressor, fit_predict) for cutoff in cutoffs]
+        results = [future.result() for future in futures]
+
+    actual = np.vstack([result[0] for result in results])
+    predicted = np.vstack([result[1] for result in results])
+    folds = pd.DataFrame({
+        'cutoff': np.repeat(data['ds'].iloc[[c - 1 for c in cutoffs]].to_numpy(), horizon),
+        'step': np.tile(np.arange(1, horizon + 1), len(cutoffs)),
+        'Actual': actual.reshape(-1),
+        'Predicted': predicted.reshape(-1),
+        'fit_seconds': np.repeat([result[2] for result in results], horizon),
+    }).dropna(subset=['Actual'])
+    return horizon_metrics(actual, predicted), folds
+
+
+def compare_engines(data: DataFrame, horizon, selected_regressor, engines=None, stride=7, initial=None, executor=None):
+    # Accuracy over all folds and steps next to the mean fit time, one row per engine
+    rows = []
+    for engine in engines or list(FORECASTERS):
+        metrics, folds = rolling_origin_evaluation(
+            data, horizon, selected_regressor, stride=stride, initial=initial,
+            fit_predict=FORECASTERS[engine], executor=executor
+        )
+        summary = horizon_metrics(
+            folds['Actual'].to_numpy().reshape(-1, 1), folds['Predicted'].to_numpy().reshape(-1, 1)
+        ).iloc[0]
+        rows.append({
+            'engine': engine,
+            'folds': folds['cutoff'].nunique(),
+            'MAE': summary['MAE'],
+            'MAPE': summary['MAPE'],
+            'RMSE': summary['RMSE'],
+            'fit_seconds': folds.groupby('cutoff')['fit_seconds'].first().mean(),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # Nightly evaluation: python -m core.backtest CITY REGRESSOR [--horizon 30 --stride 7 --engine all]
+    parser = argparse.ArgumentParser(description="Rolling-origin evaluation of the API forecast.")
+    parser.add_argument("city")
+    parser.add_argument("regressor")
+    parser.add_argument("--data", default=DASHBOARD_DATA)
+    parser.add_argument("--horizon", type=int, default=30)
+    parser.add_argument("--stride", type=int, default=7)
+    parser.add_argument("--initial", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--engine", default='prophet', choices=list(FORECASTERS) + [GLOBAL_ENGINE, 'all'],
+                        help="forecasting engine, or 'all' to compare accuracy and fit time of every engine")
+    parser.add_argument("--output", help="write per-fold predictions to this CSV file")
+    parser.add_argument("--country", default=",".join(DASHBOARD_FILTERS['Country']),
+                        help="comma-separated countries of the partition to use, '' for the whole feed")
+    args = parser.parse_args()
+
+    cube = open_cube(ensure_store(args.data, country_filters(args.country)))
+    city_data = forecast_input(cube, args.city, args.regressor)
+    if args.engine == GLOBAL_ENGINE:
+        # One model over every city's history; fits are shared by the cities of each cutoff
+        fit_predict = city_fit_predict(GlobalForecaster(global_panel(cube, args.regressor), args.regressor), args.city)
+    else:
+        fit_predict = FORECASTERS.get(args.engine)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if args.engine == 'all':
+            print(compare_engines(
+                city_data, args.horizon, args.regressor, stride=args.stride, initial=args.initial, executor=executor
+            ).to_string(index=False))
+        else:
+            metrics, folds = rolling_origin_evaluation(
+                city_data, args.horizon, args.regressor, stride=args.stride, initial=args.initial,
+                fit_predict=fit_predict, executor=executor
+            )
+            print(metrics.to_string(index=False))
+            if args.output:
+                folds.to_csv(args.output, index=False)
@@ -0,0 +1,116 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core.backtest import BACKTEST_WORKERS, rolling_origin_evaluation
+from core.cube import REQUIRED_POLLUTANTS, open_cube
+from core.forecast import TRAINING_PERCENTAGES, fit_forecast, forecast_input, perform_backtest_with_percentage
+from core.forecasters import FORECASTERS, GLOBAL_ENGINE
+from core.global_forecast import city_fit_predict, forecast_all_cities, global_panel
+from core.results_store import HORIZON_BUCKETS, save_result, stored_fingerprint
+from core.store import DASHBOARD_DATA, DASHBOARD_FILTERS, country_filters, ensure_store
+
+
+def evaluate_city(result, city_data, selected_city, selected_regressor, bucket, engine, rolling, fit_predict=None):
+    # Split backtests and the optional rolling-origin metrics into result, then store it. A split
+    # with too little data (ValueError) is left out, as in the tab; any other error is recorded in
+    # result['failures'] so it is not mistaken for missing data.
+    result['failures'] = {}
+    for percentage in TRAINING_PERCENTAGES:
+        try:
+            result['backtests'][percentage] = perform_backtest_with_percentage(
+                city_data, percentage, bucket, selected_regressor, engine, {'city': selected_city}, fit_predict
+            )
+        except ValueError:
+            pass
+        except Exception as error:
+            result['failures'][percentage] = f"{type(error).__name__}: {error}"
+    if rolling:
+        try:
+            result['rolling'] = rolling_origin_evaluation(
+                city_data, bucket, selected_regressor, fit_predict=fit_predict or FORECASTERS[engine]
+            )[0]
+        except ValueError:
+            pass
+        except Exception as error:
+            result['failures']['rolling'] = f"{type(error).__name__}: {error}"
+    save_result(result, selected_city, selected_regressor, bucket, engine)
+    return result['failures']
+
+
+def forecast_city(city_data, selected_city, selected_regressor, bucket, engine, rolling):
+    # Everything the Forecasting tab shows for one city, regressor, horizon bucket and engine
+    result = {
+        'fingerprint': stored_fingerprint(city_data),
+        'forecast': fit_forecast(city_data, bucket, selected_regressor, engine, {'city': selected_city})['forecast'],
+        'backtests': {},
+        'rolling': None,
+    }
+    failures = evaluate_city(result, city_data, selected_city, selected_regressor, bucket, engine, rolling)
+    return selected_city, selected_regressor, bucket, engine, failures
+
+
+def forecast_cities(panel, selected_regressor, bucket, rolling):
+    # The global engine for every city of one regressor and horizon bucket: one fit and one batched
+    # prediction for the forecasts, and one fit per cutoff shared by the backtests of all cities
+    forecaster, forecasts = forecast_all_cities(panel, bucket, selected_regressor)
+    # Every city's result depends on the rows of all cities
+    fingerprint = stored_fingerprint(None, panel)
+    failures = {}
+    for selected_city, forecast in forecasts.items():
+        city_data = panel[panel['City'] == selected_city].drop(columns='City').reset_index(drop=True)
+        result = {'fingerprint': fingerprint, 'forecast': forecast, 'backtests': {}, 'rolling': None}
+        city_failures = evaluate_city(
+            result, city_data, selected_city, selected_regressor, bucket, GLOBAL_ENGINE, rolling,
+            city_fit_predict(forecaster, selected_city)
+        )
+        failures.update({f"{selected_city} {split}": error for split, error in city_failures.items()})
+    return f"{len(forecasts)} cities", selected_regressor, bucket, GLOBAL_ENGINE, failures
+
+
+def batch_tasks(cube, engines):
+    # Every city x regressor x horizon bucket x engine with enough data to fit
+    regressors = [specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS]
+    engines = [engine for engine in engines if engine != GLOBAL_ENGINE]
+    for selected_city in cube.cities:
+        for selected_regressor in regressors:
+            city_data = forecast_input(cube, selected_city, selected_regressor)
+            if len(city_data) < 2:
+                continue
+            for bucket in HORIZON_BUCKETS:
+                for engine in engines:
+                    yield city_data, selected_city, selected_regressor, bucket, engine
+
+
+def global_tasks(cube):
+    # Every regressor x horizon bucket for the global engine, all cities at once
+    for selected_regressor in [specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS]:
+        panel = global_panel(cube, selected_regressor)
+        for bucket in HORIZON_BUCKETS:
+            yield panel, selected_regressor, bucket
+
+
+if __name__ == "__main__":
+    # Precompute forecasts: python -m core.batch_forecast [--workers N] [--engines sarimax,prophet,global_gbm] [--rolling]
+    parser = argparse.ArgumentParser(description="Precompute forecasts and backtests for every city and regressor.")
+    parser.add_argument("--data", default=DASHBOARD_DATA)
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--engines", default=",".join(FORECASTERS), help="comma-separated forecasting engines")
+    parser.add_argument("--rolling", action="store_true", help="also run the rolling-origin evaluation")
+    parser.add_argument("--country", default=",".join(DASHBOARD_FILTERS['Country']),
+                        help="comma-separated countries of the partition to use, '' for the whole feed")
+    args = parser.parse_args()
+
+    cube = open_cube(ensure_store(args.data, country_filters(args.country)))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        engines = args.engines.split(",")
+        futures = [executor.submit(forecast_city, *task, args.rolling) for task in batch_tasks(cube, engines)]
+        if GLOBAL_ENGINE in engines:
+            futures += [executor.submit(forecast_cities, *task, args.rolling) for task in global_tasks(cube)]
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                selected_city, selected_regressor, bucket, engine, failures = future.result()
+                print(f"[{done}/{len(futures)}] {selected_city} / {selected_regressor} / {bucket} days / {engine}")
+                for split, error in failures.items():
+                    print(f"    backtest {split} failed: {error}")
+            except Exception as error:
+                print(f"[{done}/{len(futures)}] failed: {error}")
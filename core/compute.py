@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.cube import Cube
+
+# What the tabs plot, as pure functions of the cube and hashable parameters. Results are small
+# frames, so they can be memoized per data version (see tabs/cached_compute.py) or computed in a worker.
+
+
+def monthly_api(cube: Cube, cities) -> DataFrame:
+    # city, month ("YYYY-MM"), api: the API of a month is the maximum daily API
+    result = cube.rollups.monthly(cities, 'api', stat='max')
+    result.columns = [col.lower() for col in result.columns]
+    return result
+
+
+def month_of_year_mean(cube: Cube, cities, column, pooled=False) -> DataFrame:
+    # City (unless pooled), Month name in calendar order and the mean of column
+    return cube.rollups.month_of_year_mean(cities, column, pooled=pooled)
+
+
+def season_mean(cube: Cube, cities, column) -> DataFrame:
+    # City, Season and the mean of column
+    return cube.rollups.season_mean(cities, column)
+
+
+def average_api(cube: Cube, cities) -> DataFrame:
+    # city, api: mean daily API over the whole history, most polluted first
+    result = cube.rollups.overall_mean(cities, 'api').rename(columns={'City': 'city'})
+    return result.sort_values(by='api', ascending=False).reset_index(drop=True)
+
+
+def daily_values(cube: Cube, city, column):
+    # Daily values of a species or 'api' for one city, NaN on missing days; None if unknown
+    if city not in cube.cities:
+        return None
+    if column == 'api':
+        return np.asarray(cube.api[cube.cities.get_loc(city)])
+    if column not in cube.species:
+        return None
+    return np.asarray(cube.values[cube.cities.get_loc(city), :, cube.species.get_loc(column)])
+
+
+def specie_pair(cube: Cube, city, x_column, y_column) -> DataFrame:
+    # Date, x_column, y_column on the days of one city where both are observed
+    x, y = daily_values(cube, city, x_column), daily_values(cube, city, y_column)
+    if x is None or y is None:
+        return pd.DataFrame(columns=['Date', x_column, y_column])
+    both = ~np.isnan(x) & ~np.isnan(y)
+    return pd.DataFrame({'Date': cube.dates[both], x_column: x[both], y_column: y[both]})
+
+
+def box_stats(data: DataFrame, group, value, max_outliers=50):
+    # Quartiles and Tukey whiskers per group (linear quartiles, like plotly), and the most extreme
+    # outliers of each group, so a box plot ships a few numbers per box instead of every point
+    stats, outliers = [], []
+    for name, values in data.groupby(group, sort=False, observed=True)[value]:
+        values = values.dropna().to_numpy(dtype=float)
+        if not len(values):
+            continue
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+        inside = values[(values >= low) & (values <= high)]
+        stats.append({
+            group: name, 'q1': q1, 'median': median, 'q3': q3,
+            'lowerfence': inside.min(), 'upperfence': inside.max(), 'mean': values.mean(), 'count': len(values),
+        })
+        extreme = values[(values < low) | (values > high)]
+        extreme = extreme[np.argsort(-np.abs(extreme - median), kind='stable')[:max_outliers]]
+        outliers.append(pd.DataFrame({group: name, value: extreme}))
+    outliers = pd.concat(outliers, ignore_index=True) if outliers else pd.DataFrame(columns=[group, value])
+    return pd.DataFrame(stats, columns=[group, 'q1', 'median', 'q3', 'lowerfence', 'upperfence', 'mean', 'count']), outliers
+
+
+def monthly_api_box(cube: Cube, cities):
+    # Box statistics of the monthly API per city
+    return box_stats(monthly_api(cube, cities), 'city', 'api')
+
+
+def daily_box(cube: Cube, cities, column):
+    # Box statistics of the daily values of column per city
+    if column not in cube.species:
+        return box_stats(pd.DataFrame(columns=['City', column]), 'City', column)
+    return box_stats(cube.frame(cities=cities, species=[column]), 'City', column)
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of threshold points that keep the visual shape of a
+    # series. First and last points are kept; every bucket in between keeps the point forming the
+    # largest triangle with the previous pick and the mean of the next bucket.
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    x, y = x.astype(float), np.asarray(y, dtype=float)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        mean_x, mean_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def density_bins(x, y, bins):
+    # 2D histogram of a scatter: bin centres along x and y and counts[y_bin, x_bin]
+    counts, x_edges, y_edges = np.histogram2d(np.asarray(x, dtype=float), np.asarray(y, dtype=float), bins=bins)
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts.T
+
+
+def ols_line(x, y):
+    # End points of the least-squares line y = a + b x over the range of x
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    slope, intercept = np.polyfit(x, y, 1)
+    ends = np.array([x.min(), x.max()])
+    return ends, intercept + slope * ends
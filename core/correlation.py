@@ -0,0 +1,142 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.compute import daily_values
+from core.cube import Cube
+
+# Day lags of y behind x computed by default: same day, next day, a week later
+CORRELATION_LAGS = (0, 1, 7)
+
+STATISTICS = ['n', 'slope', 'intercept', 'r2', 'pearson', 'spearman']
+
+
+def daily_columns(cube: Cube, city_idx):
+    # (city, day, species + 'api') block of the daily series of the cities at city_idx
+    values = np.concatenate([np.asarray(cube.values[city_idx]), np.asarray(cube.api[city_idx])[:, :, None]], axis=2)
+    return values, list(cube.species) + ['api']
+
+
+def joint_spearman(x, y):
+    # Spearman correlation of every (i, j) column pair of one city, ranking each pair over the days
+    # both are observed (average ranks for ties); x, y: (day, column)
+    both = ~np.isnan(x)[:, :, None] & ~np.isnan(y)[:, None, :]
+    n_days, n_columns = x.shape
+    x_pairs = np.where(both, x[:, :, None], np.nan).reshape(n_days, -1)
+    y_pairs = np.where(both, y[:, None, :], np.nan).reshape(n_days, -1)
+    x_ranks = pd.DataFrame(x_pairs).rank().to_numpy()
+    y_ranks = pd.DataFrame(y_pairs).rank().to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        x_ranks = x_ranks - np.nanmean(x_ranks, axis=0)
+        y_ranks = y_ranks - np.nanmean(y_ranks, axis=0)
+        spearman = np.nansum(x_ranks * y_ranks, axis=0) / np.sqrt(
+            np.nansum(x_ranks ** 2, axis=0) * np.nansum(y_ranks ** 2, axis=0)
+        )
+    return spearman.reshape(n_columns, n_columns)
+
+
+def pairwise_moments(x, y):
+    # Sums over the days where both x[:, :, i] and y[:, :, j] are observed, for every city and (i, j)
+    x_seen, y_seen = ~np.isnan(x), ~np.isnan(y)
+    x, y = np.where(x_seen, x, 0.0), np.where(y_seen, y, 0.0)
+    x_seen, y_seen = x_seen.astype(float), y_seen.astype(float)
+    n = np.einsum('cdi,cdj->cij', x_seen, y_seen)
+    sum_x = np.einsum('cdi,cdj->cij', x, y_seen)
+    sum_y = np.einsum('cdi,cdj->cij', x_seen, y)
+    sum_xx = np.einsum('cdi,cdj->cij', x * x, y_seen)
+    sum_yy = np.einsum('cdi,cdj->cij', x_seen, y * y)
+    sum_xy = np.einsum('cdi,cdj->cij', x, y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sum_xy - sum_x * sum_y / n
+        var_x = sum_xx - sum_x ** 2 / n
+        var_y = sum_yy - sum_y ** 2 / n
+    return n, sum_x, sum_y, cov, var_x, var_y
+
+
+def ols_fit(n, sum_x, sum_y, cov, var_x, var_y):
+    # slope, intercept and Pearson correlation of y = intercept + slope x from the pairwise moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = cov / var_x
+        intercept = (sum_y - slope * sum_x) / n
+        pearson = cov / np.sqrt(var_x * var_y)
+    return slope, intercept, pearson
+
+
+def lagged(values, lag):
+    # x on day d paired with y on day d + lag
+    n_days = values.shape[1]
+    return values[:, :n_days - lag], values[:, lag:]
+
+
+def pair_statistics(cube: Cube, lags=CORRELATION_LAGS, cities=None) -> DataFrame:
+    # One row per lag, city and ordered (x, y) pair of species or 'api': the OLS fit y = intercept + slope x,
+    # its R² and Pearson correlation from one batched pass per lag, and the Spearman correlation
+    # from one ranking pass per lag and city. cities: the cities to compute, every city by default;
+    # a view of one city costs days x columns² for that city alone.
+    city_idx = np.arange(len(cube.cities)) if cities is None else cube.cities.get_indexer(list(cities))
+    city_idx = city_idx[city_idx >= 0]
+    values, columns = daily_columns(cube, city_idx)
+    n_cities, n_columns = len(city_idx), len(columns)
+
+    frames = []
+    for lag in lags:
+        if lag >= values.shape[1]:
+            continue
+        x, y = lagged(values, lag)
+        n, sum_x, sum_y, cov, var_x, var_y = pairwise_moments(x, y)
+        spearman = np.stack([joint_spearman(x[city], y[city]) for city in range(n_cities)]) if n_cities else n
+        slope, intercept, pearson = ols_fit(n, sum_x, sum_y, cov, var_x, var_y)
+        frames.append(pd.DataFrame({
+            'lag': lag,
+            'City': np.repeat(cube.cities[city_idx].to_numpy(), n_columns * n_columns),
+            'x': np.tile(np.repeat(columns, n_columns), n_cities),
+            'y': np.tile(columns, n_cities * n_columns),
+            'n': n.reshape(-1).astype(np.int64),
+            'slope': slope.reshape(-1),
+            'intercept': intercept.reshape(-1),
+            'r2': (pearson ** 2).reshape(-1),
+            'pearson': pearson.reshape(-1),
+            'spearman': spearman.reshape(-1),
+        }))
+    if not frames:
+        return pd.DataFrame(columns=['lag', 'City', 'x', 'y'] + STATISTICS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def pair_fit(statistics: DataFrame, city, x, y, lag=0):
+    # Stored row of one pair, or None when the pair was not computed or has no fit
+    match = statistics[
+        (statistics['lag'] == lag) & (statistics['City'] == city) & (statistics['x'] == x) & (statistics['y'] == y)
+    ]
+    if match.empty or not np.isfinite(match['slope'].iloc[0]):
+        return None
+    return match.iloc[0]
+
+
+def correlation_matrix(statistics: DataFrame, city, method='pearson', lag=0) -> DataFrame:
+    # Square x by y matrix of one city's correlations
+    rows = statistics[(statistics['lag'] == lag) & (statistics['City'] == city)]
+    columns = rows['x'].unique()
+    return rows.pivot(index='x', columns='y', values=method).reindex(index=columns, columns=columns)
+
+
+def trendline(statistics: DataFrame, city, x, y, lag=0):
+    # (intercept, slope) of the stored fit of y on x, or None
+    fit = pair_fit(statistics, city, x, y, lag)
+    return None if fit is None else (fit['intercept'], fit['slope'])
+
+
+def city_trendline(cube: Cube, city, x, y, lag=0):
+    # (intercept, slope) of the fit of y on x in one city from the moments of that pair alone, or None.
+    # The same fit pair_statistics stores, for views that draw a trendline and no matrix.
+    x_values, y_values = daily_values(cube, city, x), daily_values(cube, city, y)
+    if x_values is None or y_values is None or lag >= len(x_values):
+        return None
+    x_values, y_values = x_values[:len(x_values) - lag], y_values[lag:]
+    slope, intercept, _ = ols_fit(*pairwise_moments(x_values[None, :, None], y_values[None, :, None]))
+    if not np.isfinite(slope[0, 0, 0]):
+        return None
+    return intercept[0, 0, 0], slope[0, 0, 0]
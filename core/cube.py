@@ -0,0 +1,211 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.rollups import build_rollups, open_rollups
+
+# List of required pollutants for API calculation
+REQUIRED_POLLUTANTS = ['pm10', 'pm25', 'no2', 'o3', 'so2', 'co']
+
+
+class Cube:
+    # Dense city x day x species array of daily medians, built once per dataset
+    def __init__(self, cities, dates, species, values, api=None, version=None):
+        self.cities = cities
+        self.dates = dates
+        self.species = species
+        self.values = values
+        self.api = daily_api(values, species) if api is None else api
+        self._rollups = None
+        # Identifies the data the cube was opened from; cached computations are keyed by it
+        self.version = version
+
+    @property
+    def rollups(self):
+        # Month aggregates of every species and the API; persisted with the store, else built on first use
+        if self._rollups is None:
+            self._rollups = build_rollups(self.cities, self.dates, self.species, self.values, self.api)
+        return self._rollups
+
+    def available_pollutants(self):
+        return [p for p in REQUIRED_POLLUTANTS if p in self.species]
+
+    def frame(self, cities=None, species=None) -> DataFrame:
+        # Long (City, Date) frame with one column per species plus 'api', like the old pivot_table output
+        city_idx = np.arange(len(self.cities)) if cities is None else self.cities.get_indexer(list(cities))
+        city_idx = city_idx[city_idx >= 0]
+        species_list = list(self.species) if species is None else [s for s in species if s in self.species]
+        species_idx = [self.species.get_loc(s) for s in species_list]
+
+        block = self.values[city_idx][:, :, species_idx]
+        n_cities, n_days = len(city_idx), len(self.dates)
+
+        result = pd.DataFrame(block.reshape(n_cities * n_days, len(species_idx)), columns=species_list)
+        result.insert(0, 'City', np.repeat(self.cities[city_idx].to_numpy(), n_days))
+        result.insert(1, 'Date', np.tile(self.dates.to_numpy(), n_cities))
+        result['api'] = self.api[city_idx].reshape(-1)
+
+        # Drop (City, Date) rows with no observation for any of the selected species
+        has_value = ~np.isnan(block).all(axis=2).reshape(-1)
+        return result[has_value].reset_index(drop=True)
+
+    def series(self, city, specie):
+        # Daily series of one species (or 'api') for one city, missing days dropped
+        city_pos = self.cities.get_loc(city)
+        if specie == 'api':
+            values = self.api[city_pos]
+        else:
+            values = self.values[city_pos, :, self.species.get_loc(specie)]
+        result = pd.Series(values, index=self.dates, name=specie)
+        return result.dropna()
+
+
+def daily_api(values, species):
+    # API is the maximum value across the available pollutants for each city and day
+    pollutant_idx = [species.get_loc(p) for p in REQUIRED_POLLUTANTS if p in species]
+    if pollutant_idx:
+        return np.fmax.reduce(values[..., pollutant_idx], axis=-1)
+    return np.full(values.shape[:-1], np.nan)
+
+
+def build_cube(data: DataFrame) -> Cube:
+    # Convert 'Date' column to datetime format and drop invalid rows
+    dates = pd.to_datetime(data['Date'], errors='coerce').dt.normalize()
+    medians = pd.to_numeric(data['median'], errors='coerce')
+    valid = dates.notna() & medians.notna()
+    dates, medians = dates[valid], medians[valid]
+    city_col = data.loc[valid, 'City'].astype(str)
+    specie_col = data.loc[valid, 'Specie'].astype(str).str.lower()
+
+    # Keep cities and species in order of first appearance, like data['City'].unique()
+    cities = pd.Index(pd.unique(city_col))
+    species = pd.Index(pd.unique(specie_col))
+    if dates.empty:
+        day_range = pd.DatetimeIndex([])
+    else:
+        day_range = pd.date_range(dates.min(), dates.max(), freq='D')
+
+    city_codes = cities.get_indexer(city_col)
+    specie_codes = species.get_indexer(specie_col)
+    day_codes = ((dates - day_range[0]).dt.days.to_numpy() if len(day_range) else np.array([], dtype=int))
+
+    # Same aggregation as pivot_table(aggfunc='max') over duplicate (City, Date, Specie) rows
+    values = np.full((len(cities), len(day_range), len(species)), np.nan)
+    np.fmax.at(values, (city_codes, day_codes, specie_codes), medians.to_numpy(dtype=float))
+
+    return Cube(cities, day_range, species, values)
+
+
+# On disk the cube is stored day-major, (day, city, species), so that new days are appended
+# at the end of the file instead of rewriting the history
+def save_cube(cube: Cube, path):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "cube_values.bin"), "wb") as f:
+        f.write(np.ascontiguousarray(cube.values.transpose(1, 0, 2), dtype=np.float64).tobytes())
+    with open(os.path.join(path, "cube_api.bin"), "wb") as f:
+        f.write(np.ascontiguousarray(cube.api.T, dtype=np.float64).tobytes())
+    return cube_meta(cube)
+
+
+def write_cube_chunks(path, cities, species, start, days, chunks, block_cells=2 ** 22):
+    # Persist the cube of rows that arrive as (day, city, species, median) code chunks without holding
+    # the rows: cells are max-merged into the mapped day-major files, then the API is derived a block
+    # of days at a time. Returns the cube meta and the mapped (day, city, species) and (day, city) arrays.
+    meta = {'cities': [str(c) for c in cities], 'species': [str(s) for s in species], 'start': start, 'days': days}
+    block_days = max(1, block_cells // max(1, len(cities) * len(species)))
+    for name, cells in (("cube_values.bin", len(cities) * len(species)), ("cube_api.bin", len(cities))):
+        with open(os.path.join(path, name), "wb") as f:
+            for first in range(0, days, block_days):
+                f.write(np.full(min(block_days, days - first) * cells, np.nan).tobytes())
+    values, api = map_cube_files(path, meta, mode='r+')
+
+    # Same aggregation as pivot_table(aggfunc='max') over duplicate (City, Date, Specie) rows
+    for day_codes, city_codes, specie_codes, medians in chunks:
+        np.fmax.at(values, (day_codes, city_codes, specie_codes), medians)
+    for first in range(0, days, block_days):
+        api[first:first + block_days] = daily_api(values[first:first + block_days], species)
+    if days:
+        values.flush()
+        api.flush()
+    return meta, values, api
+
+
+def cube_meta(cube: Cube):
+    return {
+        'cities': [str(c) for c in cube.cities],
+        'species': [str(s) for s in cube.species],
+        'start': str(cube.dates[0].date()) if len(cube.dates) else None,
+        'days': len(cube.dates),
+    }
+
+
+def map_cube_files(path, meta, mode='r'):
+    shape = (meta['days'], len(meta['cities']), len(meta['species']))
+    if meta['days'] == 0:
+        return np.full(shape, np.nan), np.full(shape[:2], np.nan)
+    values = np.memmap(os.path.join(path, "cube_values.bin"), dtype=np.float64, mode=mode, shape=shape)
+    api = np.memmap(os.path.join(path, "cube_api.bin"), dtype=np.float64, mode=mode, shape=shape[:2])
+    return values, api
+
+
+def data_version(path, store_meta):
+    # Names the store (its source file and partition filters) and the rows ingested into it, so
+    # two partitions of one source never share a version
+    return (os.path.basename(os.path.normpath(path)), store_meta['rows'], store_meta['source']['size'], store_meta['source']['mtime_ns'])
+
+
+def open_cube(path) -> Cube:
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        store_meta = json.load(f)
+    meta = store_meta['cube']
+    values, api = map_cube_files(path, meta)
+    if meta['days']:
+        dates = pd.date_range(meta['start'], periods=meta['days'], freq='D')
+    else:
+        dates = pd.DatetimeIndex([])
+    # Transposed views keep the (city, day, species) indexing used by the tabs
+    cube = Cube(
+        pd.Index(meta['cities']), dates, pd.Index(meta['species']), values.transpose(1, 0, 2), api.T, data_version(path, store_meta)
+    )
+    if 'rollups' in store_meta:
+        cube._rollups = open_rollups(path, store_meta['rollups'], cube.cities)
+    return cube
+
+
+def append_to_cube(path, meta, rows: DataFrame):
+    # Merge new rows into the persisted cube in place. Returns the updated cube meta and the touched
+    # (day, city) cells with their species + API values before and after, or None when the rows
+    # introduce a city, species or date the day-major layout cannot append to
+    cities, species = pd.Index(meta['cities']), pd.Index(meta['species'])
+    city_codes = cities.get_indexer(rows['City'].astype(str))
+    specie_codes = species.get_indexer(rows['Specie'].astype(str).str.lower())
+    if meta['start'] is None or (city_codes < 0).any() or (specie_codes < 0).any():
+        return None
+    day_codes = (rows['Date'].dt.normalize() - pd.Timestamp(meta['start'])).dt.days.to_numpy()
+    if (day_codes < 0).any():
+        return None
+
+    # Grow the day axis by appending NaN days to the end of both files
+    new_days = max(meta['days'], int(day_codes.max()) + 1) - meta['days']
+    if new_days:
+        cells = new_days * len(cities)
+        with open(os.path.join(path, "cube_values.bin"), "ab") as f:
+            f.write(np.full(cells * len(species), np.nan).tobytes())
+        with open(os.path.join(path, "cube_api.bin"), "ab") as f:
+            f.write(np.full(cells, np.nan).tobytes())
+    meta = dict(meta, days=meta['days'] + new_days)
+
+    values, api = map_cube_files(path, meta, mode='r+')
+    touched = np.unique(np.stack([day_codes, city_codes]), axis=1)
+    old = np.concatenate([values[touched[0], touched[1]], api[touched[0], touched[1]][:, None]], axis=1)
+    np.fmax.at(values, (day_codes, city_codes, specie_codes), rows['median'].to_numpy(dtype=float))
+
+    # Only the touched (day, city) cells need their API recomputed
+    api[touched[0], touched[1]] = daily_api(values[touched[0], touched[1]], species)
+    new = np.concatenate([values[touched[0], touched[1]], api[touched[0], touched[1]][:, None]], axis=1)
+    values.flush()
+    api.flush()
+    return meta, (touched[0], touched[1], old, new)
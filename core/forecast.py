@@ -0,0 +1,103 @@
+import time
+from importlib.metadata import version
+
+import pandas as pd
+
+from core.cube import REQUIRED_POLLUTANTS, Cube
+from core.forecasters import FORECASTERS, GBM_CONFIG, GLOBAL_ENGINE, PROPHET_CONFIG, SEASON_LENGTH, fit_prophet, prophet_fit_predict
+
+# Scenarios: training percentages of the split backtests
+TRAINING_PERCENTAGES = [0.3, 0.5, 0.7, 0.9]
+
+
+def forecast_input(cube: Cube, selected_city, selected_regressor):
+    # API and regressor of one city as Prophet input (ds, y, regressor)
+    city_data = cube.frame(cities=[selected_city], species=REQUIRED_POLLUTANTS + [selected_regressor])
+    city_data = city_data.rename(columns={'Date': 'ds', 'api': 'y'})
+    return city_data[['ds', 'y', selected_regressor]].dropna().reset_index(drop=True)
+
+
+def model_config(engine='prophet'):
+    # Versions come from the installed package metadata, so keying a fit does not import its library
+    if engine == GLOBAL_ENGINE:
+        return {'engine': engine, 'version': version('scikit-learn'), 'params': GBM_CONFIG}
+    if engine == 'prophet':
+        return {'engine': engine, 'version': version('prophet'), 'params': PROPHET_CONFIG}
+    return {'engine': engine, 'version': version('statsmodels'), 'season_length': SEASON_LENGTH}
+
+
+def fit_forecast(city_data: pd.DataFrame, forecast_horizon: int, selected_regressor, engine='prophet', series=None):
+    # series, e.g. {'city': ...}, names the history so a Prophet refit warm-starts from its last fit
+    if engine != 'prophet':
+        # Statistical engines forecast the days after the history, with the regressor held at its last value
+        future = pd.DataFrame({'ds': pd.date_range(city_data['ds'].max(), periods=forecast_horizon + 1, freq='D')[1:]})
+        future[selected_regressor] = city_data[selected_regressor].iloc[-1]
+        future['yhat'] = FORECASTERS[engine](city_data, future, selected_regressor)
+        return {'model': None, 'forecast': future}
+
+    from prophet.serialize import model_to_json
+
+    model = fit_prophet(city_data, selected_regressor, series)
+
+    # Generate future dates for prediction (e.g., next 30 days)
+    future = model.make_future_dataframe(periods=forecast_horizon, freq='D')
+    future[selected_regressor] = city_data[selected_regressor].iloc[-1]
+
+    forecast = model.predict(future)
+    return {'model': model_to_json(model), 'forecast': forecast}
+
+
+def perform_backtest_with_percentage(data: pd.DataFrame, train_percentage: float, forecast_horizon: int, selected_regressor, engine='prophet', series=None,
+                                     fit_predict=None):
+    # fit_predict(train, future, selected_regressor), when given, is used instead of the engine,
+    # e.g. for a model fitted across cities
+    # Sorting returns a new frame, so the caller's (possibly shared) frame is never modified
+    data = data.sort_values(by='ds')
+    data['ds'] = pd.to_datetime(data['ds'])
+
+    # Define training and test sizes; each split is a series of its own for warm starts
+    train_size = int(len(data) * train_percentage)
+    split = dict(series, train_percentage=train_percentage) if series else None
+    return perform_backtest(data, train_size, forecast_horizon, selected_regressor, engine, split, fit_predict)
+
+
+def perform_backtest(data: pd.DataFrame, train_size: int, forecast_horizon: int, selected_regressor, engine='prophet', series=None,
+                     fit_predict=None):
+    # Fit on the first train_size rows of data (sorted by date), forecast the next forecast_horizon
+    # rows and score them. Raises ValueError when either part is empty.
+    train_data = data.iloc[:train_size]
+    test_data = data.iloc[train_size:train_size + forecast_horizon]
+    if train_data.empty or test_data.empty:
+        raise ValueError("Not enough data to backtest this split")
+
+    # Train the model and forecast only the test period, timing the fit
+    future = test_data[['ds']].copy()
+    future[selected_regressor] = data[selected_regressor].iloc[-1]
+    started = time.perf_counter()
+    if fit_predict is not None:
+        predicted_y = fit_predict(train_data, future, selected_regressor)
+    elif engine == 'prophet':
+        predicted_y = prophet_fit_predict(train_data, future, selected_regressor, series)
+    else:
+        predicted_y = FORECASTERS[engine](train_data, future, selected_regressor)
+    fit_seconds = time.perf_counter() - started
+
+    # Extract forecasted values
+    actual_y = test_data['y'].values
+
+    # Calculate errors
+    from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error
+
+    mae = mean_absolute_error(actual_y, predicted_y)
+    mape = mean_absolute_percentage_error(actual_y, predicted_y) * 100  # in percentage
+
+    # Store results in a DataFrame
+    results_df = pd.DataFrame({
+        'Date': test_data['ds'],
+        'Actual': actual_y,
+        'Predicted': predicted_y
+    })
+
+    errors = {'MAE': mae, 'MAPE': mape, 'Fit time': fit_seconds}
+    return errors, results_df
+
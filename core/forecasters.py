@@ -0,0 +1,147 @@
+import warnings
+
+import numpy as np
+from pandas import DataFrame
+
+from core.model_cache import load_cached, store_cached
+
+# Every engine is fit_predict(train, future, selected_regressor) -> yhat for the rows of future.
+# train has ds, y and the regressor; future has ds and the regressor for the dates after train.
+# prophet (with cmdstanpy) and statsmodels take seconds to import, so each engine imports its
+# library on its first fit; a session or worker that never fits with it never loads it.
+
+# Arguments passed to Prophet(); part of the model cache key
+PROPHET_CONFIG = {}
+
+# Weekly cycle of the daily series
+SEASON_LENGTH = 7
+
+# Engine fitted once across all cities (core/global_forecast.py) instead of per city, so it is not
+# in FORECASTERS; arguments passed to its HistGradientBoostingRegressor are part of the cache key
+GLOBAL_ENGINE = 'global_gbm'
+GBM_CONFIG = {'max_iter': 200, 'learning_rate': 0.1, 'random_state': 0}
+
+# A Prophet refit starts from the parameters of the last fit of the same series when its history
+# only grew at the end by at most MAX_NEW_ROWS of the rows and the scale of y moved at most
+# MAX_SCALE_CHANGE. A warm fit whose noise level grew by more than MAX_SIGMA_GROWTH is taken as
+# drift and redone from scratch.
+MAX_NEW_ROWS = 0.1
+MAX_SCALE_CHANGE = 0.1
+MAX_SIGMA_GROWTH = 0.25
+
+
+def prophet_state(model):
+    # Fitted parameters in the form Prophet.fit(init=...) takes, and what they were fitted on
+    return {
+        'init': {
+            'k': float(model.params['k'][0][0]),
+            'm': float(model.params['m'][0][0]),
+            'sigma_obs': float(model.params['sigma_obs'][0][0]),
+            'delta': model.params['delta'][0].copy(),
+            'beta': model.params['beta'][0].copy(),
+        },
+        'start': str(model.history['ds'].min()),
+        'rows': len(model.history),
+        'y_scale': float(model.y_scale),
+    }
+
+
+def warm_start(previous, train: DataFrame):
+    # Initial values for a fit on train, or None when the history changed too much to reuse them
+    if previous is None or str(train['ds'].min()) != previous['start']:
+        return None
+    if not previous['rows'] <= len(train) <= previous['rows'] * (1 + MAX_NEW_ROWS):
+        return None
+    if abs(train['y'].abs().max() / previous['y_scale'] - 1) > MAX_SCALE_CHANGE:
+        return None
+    return previous['init']
+
+
+def new_prophet(selected_regressor):
+    from prophet import Prophet
+
+    model = Prophet(**PROPHET_CONFIG)
+    model.add_regressor(selected_regressor)
+    return model
+
+
+def fit_prophet(train: DataFrame, selected_regressor, series=None):
+    # Fit Prophet on train. With series (e.g. city, regressor, split) the fit is warm-started from
+    # the last fit of that series and its parameters are kept for the next one.
+    if series is None:
+        return new_prophet(selected_regressor).fit(train)
+
+    key_parts = dict(series, kind='warm_start', regressor=selected_regressor, config=PROPHET_CONFIG)
+    previous = load_cached(**key_parts)
+    init = warm_start(previous, train)
+    model = None
+    if init is not None:
+        # Prophet itself falls back to default values for parameters whose shape changed, e.g.
+        # when the longer history switches on yearly seasonality
+        model = new_prophet(selected_regressor).fit(train, init=init)
+        if model.params['sigma_obs'][0][0] > previous['init']['sigma_obs'] * (1 + MAX_SIGMA_GROWTH):
+            model = None
+    if model is None:
+        model = new_prophet(selected_regressor).fit(train)
+    store_cached(prophet_state(model), **key_parts)
+    return model
+
+
+def prophet_fit_predict(train: DataFrame, future: DataFrame, selected_regressor, series=None):
+    # Fit on the training rows and predict only the requested dates
+    model = fit_prophet(train, selected_regressor, series)
+    return model.predict(future)['yhat'].to_numpy()
+
+
+def sarimax_fit_predict(train: DataFrame, future: DataFrame, selected_regressor):
+    # AR(1) with a constant and the regressor as exogenous input; seasonal terms make the fit markedly slower
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    model = SARIMAX(
+        train['y'].to_numpy(dtype=float), exog=train[[selected_regressor]].to_numpy(dtype=float),
+        order=(1, 0, 0), trend='c'
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fitted = model.fit(disp=False)
+    return fitted.forecast(len(future), exog=future[[selected_regressor]].to_numpy(dtype=float))
+
+
+def exp_smoothing_fit_predict(train: DataFrame, future: DataFrame, selected_regressor):
+    # Level with additive weekly seasonality; the regressor is not used
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+    seasonal = 'add' if len(train) > 2 * SEASON_LENGTH else None
+    model = ExponentialSmoothing(
+        train['y'].to_numpy(dtype=float), seasonal=seasonal, seasonal_periods=SEASON_LENGTH if seasonal else None
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fitted = model.fit()
+    return fitted.forecast(len(future))
+
+
+def seasonal_naive_fit_predict(train: DataFrame, future: DataFrame, selected_regressor):
+    # Baseline: repeat the last observed week
+    history = train['y'].to_numpy(dtype=float)
+    season = history[-SEASON_LENGTH:]
+    return np.resize(season, len(future))
+
+
+FORECASTERS = {
+    'sarimax': sarimax_fit_predict,
+    'exp_smoothing': exp_smoothing_fit_predict,
+    'seasonal_naive': seasonal_naive_fit_predict,
+    'prophet': prophet_fit_predict,
+}
+
+ENGINE_LABELS = {
+    'sarimax': "SARIMAX with regressor (fast)",
+    'exp_smoothing': "Exponential smoothing (fast)",
+    'seasonal_naive': "Seasonal naive (baseline)",
+    'prophet': "Prophet (slow)",
+    GLOBAL_ENGINE: "Gradient boosting across all cities (fast)",
+}
+
+# Interactive default: seconds of Stan optimisation per fit are too slow for a rerun
+DEFAULT_ENGINE = 'sarimax'
@@ -0,0 +1,217 @@
+import functools
+import time
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.cube import Cube
+from core.forecast import forecast_input, model_config, perform_backtest
+from core.forecasters import GBM_CONFIG, GLOBAL_ENGINE
+from core.model_cache import cached
+
+# One gradient-boosting model learns the API of every city at once, from the recent history at a
+# forecast origin, the calendar of the target day, the horizon and the city. Forecasts are direct:
+# the horizon is a feature, so every city's whole horizon is predicted in one batched call.
+# scikit-learn is imported by the first fit; building the panel does not need it. Jobs are keyed
+# by the panel and a cutoff date, never by city: one fit per cutoff serves every city, and a city's
+# result is looked up in the job's result for all cities.
+
+# Days before the origin whose API is a feature (0 is the origin itself) and trailing mean windows
+LAGS = (0, 1, 2, 6, 13)
+MEAN_WINDOWS = (7, 28)
+# Longest horizon trained; further days are predicted as this horizon
+MAX_HORIZON = 90
+# Training horizons drawn per origin day, so training rows grow with days, not days x horizons
+HORIZON_SAMPLES = 8
+# HistGradientBoostingRegressor handles at most this many categories; more cities use plain codes
+MAX_CATEGORIES = 255
+
+
+def global_panel(cube: Cube, selected_regressor) -> DataFrame:
+    # City, ds, y and the regressor of every city, as each per-city model would see them
+    frames = []
+    for city in cube.cities:
+        city_data = forecast_input(cube, city, selected_regressor)
+        city_data.insert(0, 'City', city)
+        frames.append(city_data)
+    if not frames:
+        return pd.DataFrame(columns=['City', 'ds', 'y', selected_regressor])
+    return pd.concat(frames, ignore_index=True)
+
+
+class GlobalForecaster:
+    # Dense city x day arrays of the panel; fitted models are kept per cutoff date, so the backtests
+    # of cities that share a cutoff share one fit
+    def __init__(self, panel: DataFrame, selected_regressor):
+        dates = pd.to_datetime(panel['ds'])
+        self.cities = pd.Index(pd.unique(panel['City']))
+        self.dates = pd.date_range(dates.min(), dates.max(), freq='D')
+        city_idx = self.cities.get_indexer(panel['City'])
+        day_idx = (dates - self.dates[0]).dt.days.to_numpy()
+        self.y = np.full((len(self.cities), len(self.dates)), np.nan)
+        self.x = np.full((len(self.cities), len(self.dates)), np.nan)
+        self.y[city_idx, day_idx] = panel['y'].to_numpy(dtype=float)
+        self.x[city_idx, day_idx] = panel[selected_regressor].to_numpy(dtype=float)
+
+        # Prefix sums of observed values and counts for the trailing means
+        observed = ~np.isnan(self.y)
+        self.sums = np.concatenate([np.zeros((len(self.cities), 1)), np.cumsum(np.where(observed, self.y, 0), axis=1)], axis=1)
+        self.counts = np.concatenate([np.zeros((len(self.cities), 1)), np.cumsum(observed, axis=1)], axis=1)
+        self.models = {}
+
+    def features(self, city_idx, origin_idx, horizons):
+        # One row per (city, origin day, horizon)
+        columns = [city_idx, horizons]
+        target = self.dates[0] + pd.to_timedelta(origin_idx + horizons, unit='D')
+        columns += [target.dayofweek.to_numpy(), target.month.to_numpy()]
+        for lag in LAGS:
+            day = origin_idx - lag
+            columns.append(np.where(day >= 0, self.y[city_idx, np.maximum(day, 0)], np.nan))
+        for window in MEAN_WINDOWS:
+            start = np.maximum(origin_idx + 1 - window, 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                columns.append(
+                    (self.sums[city_idx, origin_idx + 1] - self.sums[city_idx, start])
+                    / (self.counts[city_idx, origin_idx + 1] - self.counts[city_idx, start])
+                )
+        columns.append(self.x[city_idx, origin_idx])
+        return np.column_stack(columns).astype(float)
+
+    def fit(self, cutoff):
+        # Model trained on every city's targets up to the cutoff date
+        from sklearn.ensemble import HistGradientBoostingRegressor
+
+        cutoff = pd.Timestamp(cutoff)
+        if cutoff in self.models:
+            return self.models[cutoff]
+        last = self.dates.get_indexer([cutoff])[0]
+        city_idx, origin_idx = np.nonzero(~np.isnan(self.y[:, :last]))
+        rng = np.random.default_rng(0)
+        horizons = rng.integers(1, MAX_HORIZON + 1, size=(len(city_idx), HORIZON_SAMPLES)).reshape(-1)
+        city_idx, origin_idx = np.repeat(city_idx, HORIZON_SAMPLES), np.repeat(origin_idx, HORIZON_SAMPLES)
+        target_idx = origin_idx + horizons
+        keep = target_idx <= last
+        keep[keep] = ~np.isnan(self.y[city_idx[keep], target_idx[keep]])
+        city_idx, origin_idx, horizons, target_idx = city_idx[keep], origin_idx[keep], horizons[keep], target_idx[keep]
+
+        if not len(target_idx):
+            raise ValueError(f"No training targets up to {cutoff.date()}")
+
+        # A feature never observed before the cutoff (sparse regressors) cannot be binned; it is
+        # constant instead, so the trees never split on it
+        features = self.features(city_idx, origin_idx, horizons)
+        features[:, np.isnan(features).all(axis=0)] = 0
+        model = HistGradientBoostingRegressor(
+            categorical_features=[0] if len(self.cities) <= MAX_CATEGORIES else None, **GBM_CONFIG
+        )
+        model.fit(features, self.y[city_idx, target_idx])
+        self.models[cutoff] = model
+        return model
+
+    def predict(self, cutoff, cities, dates):
+        # One batched call for every (city, date) pair, each forecast from the city's last observed
+        # day up to the cutoff
+        cutoff = pd.Timestamp(cutoff)
+        model = self.fit(cutoff)
+        city_idx = self.cities.get_indexer(list(cities))
+        last = self.dates.get_indexer([cutoff])[0]
+        observed = ~np.isnan(self.y[:, :last + 1])
+        origins = last - np.argmax(observed[:, ::-1], axis=1)
+        origin_idx = origins[city_idx]
+        days = (pd.DatetimeIndex(dates) - self.dates[0]).days.to_numpy()
+        horizons = np.clip(days - origin_idx, 1, MAX_HORIZON)
+        return model.predict(self.features(city_idx, origin_idx, horizons))
+
+    def forecast(self, forecast_horizon) -> DataFrame:
+        # City, ds and yhat for the days after the history of every city, from one fit
+        rows = pd.DataFrame({
+            'City': np.repeat(self.cities.to_numpy(), forecast_horizon),
+            'ds': np.tile(self.dates[-1] + pd.to_timedelta(np.arange(1, forecast_horizon + 1), unit='D'), len(self.cities)),
+        })
+        rows['yhat'] = self.predict(self.dates[-1], rows['City'], rows['ds'])
+        return rows
+
+
+def global_fit_predict(forecaster: GlobalForecaster, selected_city, train: DataFrame, future: DataFrame, selected_regressor):
+    # fit_predict of the backtest harness: the model sees every city up to the last training day
+    return forecaster.predict(train['ds'].max(), [selected_city] * len(future), future['ds'])
+
+
+def cutoff_fit_predict(forecaster: GlobalForecaster, selected_city, cutoff, train: DataFrame, future: DataFrame,
+                       selected_regressor):
+    # fit_predict of the backtest harness that forecasts from a fixed cutoff instead of the last training day
+    return forecaster.predict(cutoff, [selected_city] * len(future), future['ds'])
+
+
+def city_fit_predict(forecaster: GlobalForecaster, selected_city):
+    # Picklable fit_predict(train, future, selected_regressor) for one city
+    return functools.partial(global_fit_predict, forecaster, selected_city)
+
+
+def cached_model(forecaster: GlobalForecaster, fingerprint, cutoff):
+    # The model fitted up to cutoff on the panel with this fingerprint, shared through the model
+    # cache by every job and process that needs it
+    cutoff = pd.Timestamp(cutoff)
+    if cutoff not in forecaster.models:
+        forecaster.models[cutoff] = cached(
+            lambda: forecaster.fit(cutoff), kind='global_model', data=fingerprint, cutoff=str(cutoff.date()),
+            config=model_config(GLOBAL_ENGINE)
+        )
+    return forecaster.models[cutoff]
+
+
+def split_cutoff(city_data: DataFrame, train_percentage: float):
+    # Last training day of a city's split backtest, as perform_backtest_with_percentage splits its
+    # rows, or None when the split has no training rows
+    train_size = int(len(city_data) * train_percentage)
+    if train_size < 1:
+        return None
+    return pd.Timestamp(pd.to_datetime(city_data['ds']).sort_values().iloc[train_size - 1])
+
+
+def forecast_all_cities(panel: DataFrame, forecast_horizon: int, selected_regressor, fingerprint=None):
+    # (forecaster, {city: forecast frame}) from one fit and one batched prediction; given the panel's
+    # fingerprint, the fit comes from the model cache
+    forecaster = GlobalForecaster(panel, selected_regressor)
+    if fingerprint is not None:
+        cached_model(forecaster, fingerprint, forecaster.dates[-1])
+    forecast = forecaster.forecast(forecast_horizon)
+    return forecaster, {
+        city: rows.drop(columns='City').reset_index(drop=True) for city, rows in forecast.groupby('City', sort=False)
+    }
+
+
+def global_forecasts(panel: DataFrame, fingerprint, forecast_horizon: int, selected_regressor):
+    # {city: result shaped like fit_forecast's} for every city, from the one model fitted on the panel
+    _, forecasts = forecast_all_cities(panel, forecast_horizon, selected_regressor, fingerprint)
+    return {city: {'model': None, 'forecast': forecast} for city, forecast in forecasts.items()}
+
+
+def global_backtests(panel: DataFrame, fingerprint, cutoff, forecast_horizon: int, selected_regressor):
+    # {city: (errors, results_df)} of every city with training and test days around cutoff, from the
+    # model fitted up to cutoff and scored by the backtest harness. A city whose split backtest ends
+    # at cutoff gets what perform_backtest_with_percentage would return for it.
+    if cutoff is None:
+        return {}
+    cutoff = pd.Timestamp(cutoff)
+    forecaster = GlobalForecaster(panel, selected_regressor)
+    started = time.perf_counter()
+    cached_model(forecaster, fingerprint, cutoff)
+    fit_seconds = time.perf_counter() - started
+
+    results = {}
+    for city, city_data in panel.groupby('City', sort=False):
+        city_data = city_data.drop(columns='City').sort_values('ds')
+        city_data['ds'] = pd.to_datetime(city_data['ds'])
+        train_size = int((city_data['ds'] <= cutoff).sum())
+        if train_size == 0 or train_size == len(city_data):
+            continue
+        # Every city is predicted by the cutoff's model, even one whose last training day is earlier
+        errors, results_df = perform_backtest(
+            city_data, train_size, forecast_horizon, selected_regressor, GLOBAL_ENGINE,
+            fit_predict=functools.partial(cutoff_fit_predict, forecaster, city, cutoff)
+        )
+        # The harness timed a prediction; the fit is what the cutoff's model took
+        results[city] = (dict(errors, **{'Fit time': fit_seconds}), results_df)
+    return results
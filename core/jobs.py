@@ -0,0 +1,356 @@
+import functools
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import CancelledError, Future, wait
+
+from core.backtest import BACKTEST_WORKERS
+from core.forecast import TRAINING_PERCENTAGES, fit_forecast, model_config, perform_backtest_with_percentage
+from core.forecasters import GLOBAL_ENGINE
+from core.global_forecast import global_backtests, global_forecasts, split_cutoff
+from core.model_cache import cache_key, cached, load_cached, store_cached
+
+# Imported by every worker as it starts instead of by its first fit: the library of the default
+# engine (statsmodels) and the backtest metrics (scikit-learn), seconds of imports on a fresh process
+WORKER_PRELOAD = ('statsmodels.tsa.statespace.sarimax', 'sklearn.metrics')
+# Fits are background work; workers run at a lower priority so page renders stay responsive
+WORKER_NICENESS = 10
+
+
+class Job:
+    # One background computation, shared by every owner that asked for the same key
+    def __init__(self, key, future):
+        self.key = key
+        self.future = future
+        self.owners = set()
+
+    @property
+    def state(self):
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.done():
+            error = self.future.exception()
+            if isinstance(error, CancelledError):
+                # Stopped while it was running
+                return 'cancelled'
+            return 'failed' if error is not None else 'done'
+        return 'running' if self.future.running() else 'queued'
+
+    def result(self):
+        return self.future.result()
+
+
+class CityJob:
+    # One city's entry of a job computed for every city at once (the global engine); used like a Job
+    def __init__(self, job, selected_city):
+        self.job = job
+        self.selected_city = selected_city
+
+    @property
+    def key(self):
+        return self.job.key
+
+    @property
+    def future(self):
+        return self.job.future
+
+    @property
+    def state(self):
+        state = self.job.state
+        if state == 'done' and self.selected_city not in self.job.result():
+            return 'failed'
+        return state
+
+    def result(self):
+        return city_result(self.job.result(), self.selected_city)
+
+
+def city_result(result, selected_city=None):
+    # selected_city's entry of a result computed for every city, or the result itself when the task
+    # was for one city (selected_city None)
+    if selected_city is None:
+        return result
+    if selected_city not in result:
+        raise ValueError(f"Not enough data for {selected_city}")
+    return result[selected_city]
+
+
+def run_and_store(key_parts, function, *args):
+    # Runs in a worker process; the result lands in the model cache even if nobody waits for it
+    return store_cached(function(*args), **key_parts)
+
+
+def forecast_tasks(city_data, selected_city, forecast_horizon, selected_regressor, engine, fingerprint, panel=None):
+    # (key_parts, call, selected_city) of the forecast and {percentage: (key_parts, call, selected_city)}
+    # of the split backtests, call being (function, *args). fingerprint is stored_fingerprint's: of
+    # city_data, or of the panel for the global engine. Per-city engines have selected_city None: the
+    # call's result is the city's. The global engine is fitted on the panel of every city, so its
+    # jobs are keyed by the panel and the cutoff only, are shared by every city and return a result
+    # per city, of which selected_city's is used (city_result, CityJob).
+    if engine == GLOBAL_ENGINE:
+        key_parts = dict(regressor=selected_regressor, horizon=forecast_horizon, data=fingerprint, config=model_config(engine))
+        forecast_task = (
+            dict(key_parts, kind='global_forecast'),
+            (global_forecasts, panel, fingerprint, forecast_horizon, selected_regressor),
+            selected_city,
+        )
+        backtest_tasks = {}
+        for percentage in TRAINING_PERCENTAGES:
+            cutoff = split_cutoff(city_data, percentage)
+            backtest_tasks[percentage] = (
+                dict(key_parts, kind='global_backtest', cutoff=None if cutoff is None else str(cutoff.date())),
+                (global_backtests, panel, fingerprint, cutoff, forecast_horizon, selected_regressor),
+                selected_city,
+            )
+        return forecast_task, backtest_tasks
+
+    key_parts = dict(city=selected_city, regressor=selected_regressor, horizon=forecast_horizon, data=fingerprint)
+    forecast_task = (
+        dict(key_parts, kind='forecast', config=model_config(engine)),
+        (fit_forecast, city_data, forecast_horizon, selected_regressor, engine, {'city': selected_city}),
+        None,
+    )
+    backtest_tasks = {
+        percentage: (
+            dict(key_parts, kind='backtest', config=dict(model_config(engine), train_percentage=percentage)),
+            (perform_backtest_with_percentage, city_data, percentage, forecast_horizon, selected_regressor, engine, {'city': selected_city}),
+            None,
+        )
+        for percentage in TRAINING_PERCENTAGES
+    }
+    return forecast_task, backtest_tasks
+
+
+def forecast_jobs(submit, stored, forecast_task, backtest_tasks):
+    # Forecast job (None when stored) and {percentage: backtest job} of the splits not in stored, the
+    # batch job's result for these fits (results_store.load_result); submit(task) makes each job
+    forecast_job = submit(forecast_task) if stored is None else None
+    precomputed = {} if stored is None else stored['backtests']
+    backtest_jobs = {
+        percentage: submit(task) for percentage, task in backtest_tasks.items() if percentage not in precomputed
+    }
+    return forecast_job, backtest_jobs
+
+
+def forecast_results(stored, forecast_job, backtest_jobs):
+    # (forecast, {percentage: (errors, results_df) or None}) of forecast_jobs' jobs once they have
+    # finished, waiting for those still running; None for a split without enough data
+    forecast = stored['forecast'] if forecast_job is None else forecast_job.result()['forecast']
+    backtests = {}
+    for percentage in TRAINING_PERCENTAGES:
+        if percentage not in backtest_jobs:
+            backtests[percentage] = stored['backtests'][percentage]
+            continue
+        try:
+            backtests[percentage] = backtest_jobs[percentage].result()
+        except ValueError:
+            backtests[percentage] = None
+    return forecast, backtests
+
+
+def finished(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def computed_job(task):
+    # Job of a forecast_tasks task computed in this process through the model cache, for callers
+    # without a JobQueue; a ValueError (not enough data) is kept in the job like a worker's
+    key_parts, call, selected_city = task
+    future = Future()
+    try:
+        future.set_result(cached(functools.partial(*call), **key_parts))
+    except ValueError as error:
+        future.set_exception(error)
+    job = Job(cache_key(**key_parts), future)
+    return job if selected_city is None else CityJob(job, selected_city)
+
+
+def worker_main(connection):
+    # Runs in a spawned worker process: (function, args) calls in, ('result' | 'error', value) out,
+    # one at a time until the pipe closes
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+    for module in WORKER_PRELOAD:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    while True:
+        try:
+            function, args = connection.recv()
+            reply = ('result', function(*args))
+        except EOFError:
+            return
+        except Exception as error:
+            reply = ('error', error)
+        try:
+            connection.send(reply)
+        except Exception as error:
+            # The result or exception does not pickle
+            connection.send(('error', RuntimeError(f"{type(error).__name__}: {error}")))
+
+
+class Worker:
+    # One spawned process and the thread feeding it calls from the pool's queue. Cancelling the call
+    # it runs terminates the process; the thread starts a fresh one for the next call.
+    def __init__(self, pool):
+        self.pool = pool
+        self.future = None
+        self.terminated = False
+        self.start_process()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def start_process(self):
+        self.connection, child = self.pool.context.Pipe()
+        self.process = self.pool.context.Process(target=worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def run(self):
+        while True:
+            call = self.pool.calls.get()
+            if call is None:
+                break
+            future, function, args = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self.pool.lock:
+                self.future = future
+            try:
+                self.connection.send((function, args))
+                outcome, value = self.connection.recv()
+            except (EOFError, OSError):
+                # The process was terminated or died
+                outcome, value = 'error', None
+            except Exception as error:
+                # The call does not pickle; the process never saw it
+                outcome, value = 'error', error
+            with self.pool.lock:
+                self.future = None
+                terminated, self.terminated = self.terminated, False
+            if outcome == 'result':
+                future.set_result(value)
+            elif terminated:
+                future.set_exception(CancelledError())
+            else:
+                future.set_exception(value or RuntimeError("The worker process running this job died"))
+            if (terminated or not self.process.is_alive()) and not self.pool.closed:
+                self.connection.close()
+                self.process.join()
+                self.start_process()
+        self.connection.close()
+        self.process.terminate()
+
+    def cancel(self, future):
+        # Terminate the process if it runs future; called with the pool lock held
+        if self.future is not future:
+            return False
+        self.terminated = True
+        self.process.terminate()
+        return True
+
+
+class WorkerPool:
+    # Spawned worker processes running one call each at a time. Unlike a ProcessPoolExecutor, a call
+    # that already started can be cancelled: its worker process is terminated and replaced. Workers
+    # start with the pool, so their start-up and WORKER_PRELOAD imports are paid before the first fit.
+    def __init__(self, workers):
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.calls = queue.SimpleQueue()
+        self.closed = False
+        self.workers = [Worker(self) for _ in range(max(1, workers))]
+
+    def submit(self, function, *args) -> Future:
+        future = Future()
+        self.calls.put((future, function, args))
+        return future
+
+    def ready(self):
+        # Block until the workers have started and imported WORKER_PRELOAD: each worker holds one
+        # call at a time, so one no-op call per worker reaches every worker
+        wait([self.submit(int) for _ in self.workers])
+
+    def cancel(self, future):
+        # Cancel a queued call, or stop a running one
+        if future.cancel():
+            return True
+        with self.lock:
+            return any(worker.cancel(future) for worker in self.workers)
+
+    def shutdown(self):
+        # Cancel queued calls, stop running ones and let the workers exit
+        self.closed = True
+        while True:
+            try:
+                future, _, _ = self.calls.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+        with self.lock:
+            for worker in self.workers:
+                if worker.future is not None:
+                    worker.cancel(worker.future)
+        for _ in self.workers:
+            self.calls.put(None)
+
+
+class JobQueue:
+    # Forecast and backtest fits run in a pool of spawned worker processes instead of the script
+    # thread. Identical jobs in flight are shared between sessions, and a job every owner has
+    # moved on from is cancelled: taken off the queue, or its worker stopped if it already started.
+    def __init__(self, workers=BACKTEST_WORKERS):
+        self.pool = WorkerPool(workers)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, owner, key_parts, function, *args) -> Job:
+        # Job computing function(*args) for key_parts: a stored result, the identical job in
+        # flight, or a new one
+        key = cache_key(**key_parts)
+        with self.lock:
+            # Failed jobs stay, so a fit that cannot succeed on this data is not retried every rerun
+            self.jobs = {k: job for k, job in self.jobs.items() if job.state not in ('done', 'cancelled')}
+            job = self.jobs.get(key)
+            if job is None:
+                stored = load_cached(**key_parts)
+                if stored is not None:
+                    job = Job(key, finished(stored))
+                else:
+                    job = Job(key, self.pool.submit(run_and_store, key_parts, function, *args))
+                    self.jobs[key] = job
+            job.owners.add(owner)
+        return job
+
+    def submit_task(self, owner, task):
+        # Job of a (key_parts, call, selected_city) task from forecast_tasks
+        key_parts, call, selected_city = task
+        job = self.submit(owner, key_parts, *call)
+        return job if selected_city is None else CityJob(job, selected_city)
+
+    def supersede(self, owner, current):
+        # owner now only wants the jobs in current; cancel the jobs nobody else wants, queued or running
+        keep = {job.key for job in current}
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if owner in job.owners and job.key not in keep:
+                    job.owners.discard(owner)
+                    if not job.owners:
+                        self.pool.cancel(job.future)
+
+    def ready(self):
+        # Block until every worker can start a fit at once; for headless callers
+        self.pool.ready()
+
+    def wait(self):
+        # Block until every job in flight has finished; for headless callers
+        with self.lock:
+            futures = [job.future for job in self.jobs.values()]
+        wait(futures)
+
+    def shutdown(self):
+        self.pool.shutdown()
@@ -0,0 +1,115 @@
+import os
+import resource
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# Anonymous memory the dashboard process may use (AIRQUALITY_MEMORY_BUDGET_MB); past it the large
+# derived caches are shed. The dataset itself stays and does not count: it is memory-mapped from
+# the store, so its resident pages belong to the page cache, are shared by every session and every
+# worker process on the host, and are not freed by dropping caches.
+MEMORY_BUDGET_BYTES = int(os.environ.get("AIRQUALITY_MEMORY_BUDGET_MB", "2048")) * 2 ** 20
+# After shedding, the budget is armed again only once anonymous memory falls below this fraction of
+# it, so a process that stays near the budget sheds once per crossing rather than on every rerun
+RESUME_FRACTION = 0.8
+
+
+def process_rss():
+    # Current resident set size; peak RSS where /proc is not available
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_anonymous():
+    # Resident anonymous memory (heap, caches), without the mapped store files; resident set size
+    # where /proc/self/status does not report it
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return process_rss()
+
+
+def is_mapped(array):
+    # Whether an array's data lives in a memory-mapped file rather than the process heap
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base if isinstance(array.base, np.ndarray) else None
+    return False
+
+
+def reachable_arrays(obj, seen=None):
+    # The numpy arrays reachable from obj through attributes, lists, tuples and dicts, each once
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        yield obj
+        return
+    if isinstance(obj, (list, tuple)):
+        children = obj
+    elif isinstance(obj, dict):
+        children = obj.values()
+    elif hasattr(obj, '__dict__') and not isinstance(obj, (pd.Index, pd.Series, DataFrame, type)):
+        children = vars(obj).values()
+    else:
+        return
+    for child in children:
+        yield from reachable_arrays(child, seen)
+
+
+def array_bytes(obj):
+    # (heap bytes, mapped bytes) of the arrays held by obj
+    heap, mapped = 0, 0
+    for array in reachable_arrays(obj):
+        if is_mapped(array):
+            mapped += array.nbytes
+        else:
+            heap += array.nbytes
+    return heap, mapped
+
+
+def freeze(obj):
+    # Objects shared between sessions are read-only: a stray in-place write raises instead of
+    # changing what every other session sees
+    for array in reachable_arrays(obj):
+        array.flags.writeable = False
+    return obj
+
+
+def memory_report(shared) -> DataFrame:
+    # One row per shared object: heap and memory-mapped megabytes
+    rows = []
+    for name, obj in shared.items():
+        heap, mapped = array_bytes(obj)
+        rows.append({'object': name, 'heap_mb': heap / 2 ** 20, 'mapped_mb': mapped / 2 ** 20})
+    return pd.DataFrame(rows, columns=['object', 'heap_mb', 'mapped_mb'])
+
+
+class MemoryBudget:
+    # Process-wide trigger: crossed() is true once each time anonymous memory rises past the budget
+    def __init__(self, budget=MEMORY_BUDGET_BYTES, resume_fraction=RESUME_FRACTION):
+        self.budget = budget
+        self.resume = budget * resume_fraction
+        self.armed = True
+        self.lock = threading.Lock()
+
+    def crossed(self):
+        used = process_anonymous()
+        with self.lock:
+            if used < self.resume:
+                self.armed = True
+            elif used > self.budget and self.armed:
+                self.armed = False
+                return True
+        return False
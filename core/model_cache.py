@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+from pandas import DataFrame
+
+# Fitted models and their forecast frames, one pickle per key, evicted least recently used first
+MODEL_CACHE_DIR = os.path.join("data", ".model_cache")
+MODEL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def data_fingerprint(data: DataFrame):
+    # Content hash of the training frame; any changed, added or removed row changes it
+    digest = hashlib.sha1(",".join(map(str, data.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(**parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cache_path(key_parts):
+    return os.path.join(MODEL_CACHE_DIR, cache_key(**key_parts) + ".pkl")
+
+
+def load_cached(**key_parts):
+    # Stored result for key_parts, or None on a miss
+    path = cache_path(key_parts)
+    try:
+        with open(path, "rb") as f:
+            result = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    # The modification time doubles as the last-used time for LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return result
+
+
+def store_cached(result, **key_parts):
+    path = cache_path(key_parts)
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    evict(MODEL_CACHE_MAX_BYTES)
+    return result
+
+
+def cached(compute, **key_parts):
+    # Return the stored result for key_parts, or compute, store and return it
+    result = load_cached(**key_parts)
+    if result is None:
+        result = store_cached(compute(), **key_parts)
+    return result
+
+
+def evict(max_bytes):
+    # Drop least recently used entries until the cache fits into max_bytes
+    entries = []
+    for entry in os.scandir(MODEL_CACHE_DIR):
+        if entry.name.endswith(".pkl"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
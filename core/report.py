@@ -0,0 +1,270 @@
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core import compute
+from core.backtest import BACKTEST_WORKERS
+from core.correlation import correlation_matrix, pair_statistics, trendline
+from core.cube import REQUIRED_POLLUTANTS, open_cube
+from core.forecast import forecast_input
+from core.forecasters import DEFAULT_ENGINE, ENGINE_LABELS, GLOBAL_ENGINE
+from core.global_forecast import global_panel
+from core.jobs import computed_job, forecast_jobs, forecast_results, forecast_tasks
+from core.model_cache import data_fingerprint
+from core.results_store import load_result, stored_fingerprint
+from core.store import DASHBOARD_DATA, DASHBOARD_FILTERS, country_filters, ensure_store
+from tabs.charts import average_api_figure, backtest_figure, correlation_figure, forecast_figure, month_of_year_figure, monthly_api_box_figure, monthly_api_figure, monthly_bar_figure, monthly_temperature_figure, pollutant_temperature_figure, season_figure, temperature_scatter_figure
+
+# Static HTML bulletin: for every city, the charts of the City, General, Insights and Forecasting
+# tabs with that city selected, in one self-contained file. Cities render in parallel worker
+# processes that map the same store. A city whose data and report options are unchanged since the
+# last run is skipped.
+
+REPORT_DIR = "reports"
+MANIFEST = "manifest.json"
+# Bumped whenever the report layout changes, so every city is rendered again
+REPORT_VERSION = 1
+# Pollutant of the Insights charts that have a pollutant selectbox
+REPORT_POLLUTANT = 'api'
+# Forecast of the reports when not chosen: the dashboard's default engine and horizon
+REPORT_HORIZON = 30
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em auto; max-width: 1200px; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>{subtitle}</p>
+{body}
+</body>
+</html>
+"""
+
+# Cube of the worker process, opened once by the pool initializer
+worker_cube = None
+
+
+def init_worker(path):
+    global worker_cube
+    worker_cube = open_cube(path)
+
+
+def report_file(selected_city):
+    return re.sub(r'[^\w-]+', '_', selected_city) + ".html"
+
+
+def resolve_options(cube, options=None):
+    # options with the defaults filled in; the regressor defaults to the first non-pollutant species
+    options = dict(options or {})
+    options.setdefault('engine', DEFAULT_ENGINE)
+    options.setdefault('horizon', REPORT_HORIZON)
+    if options.get('regressor') is None:
+        options['regressor'] = next(specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS)
+    return options
+
+
+def city_fingerprint(cube, selected_city, options, shared=""):
+    # Changes with any of the city's rows, any report option or the shared fingerprint of data
+    # every report depends on
+    digest = hashlib.sha1(json.dumps([REPORT_VERSION, options, shared], sort_keys=True).encode("utf-8"))
+    digest.update(data_fingerprint(cube.frame(cities=[selected_city])).encode("ascii"))
+    return digest.hexdigest()
+
+
+def read_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output, manifest):
+    path = os.path.join(output, MANIFEST)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def city_forecast(cube, selected_city, options):
+    # (city_data, forecast, {percentage: (errors, results_df) or None}) as the Forecasting tab shows
+    # them: the batch job's stored result, else fits from the model cache or computed here
+    selected_regressor, forecast_horizon, engine = options['regressor'], options['horizon'], options['engine']
+    city_data = forecast_input(cube, selected_city, selected_regressor)
+    if city_data.empty:
+        return city_data, None, {}
+    panel = global_panel(cube, selected_regressor) if engine == GLOBAL_ENGINE else None
+    fingerprint = stored_fingerprint(city_data, panel)
+    stored = load_result(selected_city, selected_regressor, forecast_horizon, fingerprint, engine)
+    forecast_job, backtest_jobs = forecast_jobs(
+        computed_job, stored,
+        *forecast_tasks(city_data, selected_city, forecast_horizon, selected_regressor, engine, fingerprint, panel)
+    )
+    forecast, backtests = forecast_results(stored, forecast_job, backtest_jobs)
+    return city_data, forecast, backtests
+
+
+def city_figures(cube, selected_city, statistics, options):
+    # [(section, [figure or HTML string])] of one city's report
+    cities = [selected_city]
+    sections = []
+
+    figures = []
+    monthly_temp = compute.month_of_year_mean(cube, cities, "temperature").set_index('Month')['temperature']
+    monthly_humi = compute.month_of_year_mean(cube, cities, "humidity").set_index('Month')['humidity']
+    if not monthly_temp.empty:
+        figures.append(monthly_bar_figure(monthly_temp, "Average Temperature (°C)", "Average Monthly Temperature", "orange"))
+    if not monthly_humi.empty:
+        figures.append(monthly_bar_figure(monthly_humi, "Average Humidity", "Average Monthly Humidity", "blue"))
+    for specie, color in [("pm10", "red"), ("pm25", "green")]:
+        pair = compute.specie_pair(cube, selected_city, "temperature", specie)
+        if not pair.empty:
+            figures.append(temperature_scatter_figure(pair, specie, color, trendline(statistics, selected_city, "temperature", specie)))
+    sections.append(("City", figures))
+
+    figures = []
+    box_stats, outliers = compute.monthly_api_box(cube, cities)
+    if not box_stats.empty:
+        figures.append(monthly_api_box_figure(box_stats, outliers))
+    monthly = compute.monthly_api(cube, cities)
+    if not monthly.empty:
+        figures.append(monthly_api_figure(monthly))
+    sections.append(("General", figures))
+
+    figures = [
+        month_of_year_figure(compute.month_of_year_mean(cube, cities, REPORT_POLLUTANT), REPORT_POLLUTANT),
+        monthly_temperature_figure(
+            compute.month_of_year_mean(cube, cities, 'temperature'), f"Average Monthly Temperature for {selected_city}"
+        ),
+        pollutant_temperature_figure(
+            compute.specie_pair(cube, selected_city, REPORT_POLLUTANT, 'temperature'), REPORT_POLLUTANT, selected_city,
+            trendline(statistics, selected_city, REPORT_POLLUTANT, 'temperature')
+        ),
+    ]
+    matrix = correlation_matrix(statistics, selected_city)
+    if not matrix.empty:
+        figures.append(correlation_figure(matrix, 'pearson', 0, selected_city))
+    figures.append(average_api_figure(compute.average_api(cube, cities)))
+    figures.append(season_figure(compute.season_mean(cube, cities, REPORT_POLLUTANT), REPORT_POLLUTANT))
+    sections.append(("Insights", figures))
+
+    city_data, forecast, backtests = city_forecast(cube, selected_city, options)
+    figures = []
+    if forecast is not None:
+        figures.append(forecast_figure(forecast, city_data, selected_city, options['regressor']))
+    errors = {
+        f"{int(percentage * 100)}%": result[0] for percentage, result in backtests.items() if result is not None
+    }
+    if errors:
+        figures.append(
+            "<table><tr><th>Training data</th><th>MAE</th><th>MAPE</th></tr>"
+            + "".join(f"<tr><td>{name}</td><td>{e['MAE']:.2f}</td><td>{e['MAPE']:.2f}%</td></tr>" for name, e in errors.items())
+            + "</table>"
+        )
+    figures += [backtest_figure(result[1], percentage) for percentage, result in backtests.items() if result is not None]
+    sections.append((f"Forecasting with {ENGINE_LABELS[options['engine']]}", figures))
+    return sections
+
+
+def render_city(selected_city, statistics, options, output):
+    # Write one city's report; runs in a worker process. Returns (city, seconds).
+    started = time.perf_counter()
+    sections = city_figures(worker_cube, selected_city, statistics, options)
+    body, first = [], True
+    for heading, figures in sections:
+        body.append(f"<h2>{html.escape(heading)}</h2>")
+        for figure in figures:
+            if isinstance(figure, str):
+                body.append(figure)
+                continue
+            # plotly.js is inlined once per page, so the file opens offline
+            body.append(figure.to_html(full_html=False, include_plotlyjs=first))
+            first = False
+    subtitle = (
+        f"{worker_cube.dates[0].date()} to {worker_cube.dates[-1].date()}; forecast of {options['horizon']} days "
+        f"with {html.escape(options['regressor'])} as regressor"
+    )
+    page = PAGE.format(title=html.escape(f"Air quality bulletin: {selected_city}"), subtitle=subtitle, body="\n".join(body))
+    path = os.path.join(output, report_file(selected_city))
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(page)
+    os.replace(f"{path}.tmp", path)
+    return selected_city, time.perf_counter() - started
+
+
+def write_index(output, cities):
+    links = "\n".join(
+        f'<li><a href="{html.escape(report_file(city))}">{html.escape(city)}</a></li>' for city in cities
+    )
+    with open(os.path.join(output, "index.html"), "w", encoding="utf-8") as f:
+        f.write(PAGE.format(title="Air quality bulletin", subtitle=f"{len(cities)} cities", body=f"<ul>\n{links}\n</ul>"))
+
+
+def generate_reports(data_path=DASHBOARD_DATA, output=REPORT_DIR, options=None, workers=BACKTEST_WORKERS, force=False,
+                     filters=DASHBOARD_FILTERS):
+    # Render the reports of every city whose fingerprint changed; returns {city: seconds} of those rendered.
+    # options: engine, horizon and regressor of the forecasts, each defaulted by resolve_options.
+    path = ensure_store(data_path, filters)
+    cube = open_cube(path)
+    options = resolve_options(cube, options)
+    os.makedirs(output, exist_ok=True)
+    manifest = read_manifest(output)
+    # The global engine is fitted on every city, so its reports change with every city's rows
+    shared = data_fingerprint(global_panel(cube, options['regressor'])) if options['engine'] == GLOBAL_ENGINE else ""
+    fingerprints = {city: city_fingerprint(cube, city, options, shared) for city in cube.cities}
+    changed = [
+        city for city in cube.cities
+        if force or manifest.get(city) != fingerprints[city] or not os.path.exists(os.path.join(output, report_file(city)))
+    ]
+    rendered = {}
+    if changed:
+        # Correlations and fits of every species pair of the changed cities, computed once for all workers
+        statistics = pair_statistics(cube, lags=(0,), cities=changed)
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=init_worker, initargs=(path,)) as executor:
+            futures = [
+                executor.submit(render_city, city, statistics[statistics['City'] == city], options, output)
+                for city in changed
+            ]
+            for future in as_completed(futures):
+                selected_city, seconds = future.result()
+                manifest[selected_city] = fingerprints[selected_city]
+                rendered[selected_city] = seconds
+                write_manifest(output, manifest)
+    write_index(output, list(cube.cities))
+    return rendered
+
+
+if __name__ == "__main__":
+    # Monthly bulletin: python -m core.report [--output reports] [--engine sarimax] [--horizon 30] [--force]
+    parser = argparse.ArgumentParser(description="Render a static HTML report of every city.")
+    parser.add_argument("--data", default=DASHBOARD_DATA)
+    parser.add_argument("--output", default=REPORT_DIR)
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--engine", default=DEFAULT_ENGINE, choices=list(ENGINE_LABELS))
+    parser.add_argument("--horizon", type=int, default=REPORT_HORIZON)
+    parser.add_argument("--regressor", help="forecast regressor; the first non-pollutant species by default")
+    parser.add_argument("--force", action="store_true", help="render every city, changed or not")
+    parser.add_argument("--country", default=",".join(DASHBOARD_FILTERS['Country']),
+                        help="comma-separated countries of the partition to use, '' for the whole feed")
+    args = parser.parse_args()
+
+    data_filters = country_filters(args.country)
+    report_options = {'engine': args.engine, 'horizon': args.horizon, 'regressor': args.regressor}
+    started = time.perf_counter()
+    rendered = generate_reports(args.data, args.output, report_options, args.workers, args.force, data_filters)
+    for city, seconds in rendered.items():
+        print(f"{city}: {seconds:.2f} s")
+    print(f"{len(rendered)} reports rendered in {time.perf_counter() - started:.2f} s, written to {args.output}")
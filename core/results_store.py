@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+from core.model_cache import data_fingerprint
+
+# Precomputed forecasts and backtests written by the batch job (python -m core.batch_forecast)
+RESULTS_DIR = os.path.join("data", ".results")
+
+# A forecast or backtest for horizon h is the first h days of any longer horizon, so only a
+# few horizons are fitted and requests are served from the smallest bucket that covers them
+HORIZON_BUCKETS = [30, 90]
+
+
+def horizon_bucket(forecast_horizon):
+    for bucket in HORIZON_BUCKETS:
+        if forecast_horizon <= bucket:
+            return bucket
+    return None
+
+
+def stored_fingerprint(city_data, panel=None):
+    # What a stored result is checked against: the city's rows, or for the global engine (panel
+    # given) the rows of every city, as its model is fitted on all of them
+    return data_fingerprint(city_data if panel is None else panel)
+
+
+def result_path(selected_city, selected_regressor, bucket, engine):
+    key = json.dumps([selected_city, selected_regressor, bucket, engine], ensure_ascii=False)
+    return os.path.join(RESULTS_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pkl")
+
+
+def save_result(result, selected_city, selected_regressor, bucket, engine):
+    # result: {'fingerprint', 'forecast', 'backtests': {percentage: (errors, results_df)}, 'rolling',
+    #          'failures': {percentage or 'rolling': error message}}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = result_path(selected_city, selected_regressor, bucket, engine)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def truncate_backtest(errors, results_df, forecast_horizon):
+    from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error
+
+    results_df = results_df.iloc[:forecast_horizon]
+    errors = {
+        **errors,
+        'MAE': mean_absolute_error(results_df['Actual'], results_df['Predicted']),
+        'MAPE': mean_absolute_percentage_error(results_df['Actual'], results_df['Predicted']) * 100,
+    }
+    return errors, results_df
+
+
+def load_result(selected_city, selected_regressor, forecast_horizon, fingerprint, engine):
+    # Stored result cut down to forecast_horizon, or None when missing or fitted on other data
+    bucket = horizon_bucket(forecast_horizon)
+    if bucket is None:
+        return None
+    try:
+        with open(result_path(selected_city, selected_regressor, bucket, engine), "rb") as f:
+            result = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if result['fingerprint'] != fingerprint:
+        return None
+
+    forecast = result['forecast']
+    last_date = forecast['ds'].max() - pd.Timedelta(days=bucket)
+    backtests = {
+        percentage: truncate_backtest(errors, results_df, forecast_horizon)
+        for percentage, (errors, results_df) in result['backtests'].items()
+    }
+    rolling = result.get('rolling')
+    return {
+        'forecast': forecast[forecast['ds'] <= last_date + pd.Timedelta(days=forecast_horizon)],
+        'backtests': backtests,
+        'rolling': None if rolling is None else rolling[rolling['step'] <= forecast_horizon],
+    }
@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+MONTH_ORDER = ["January", "February", "March", "April", "May", "June",
+               "July", "August", "September", "October", "November", "December"]
+
+SEASONS = {
+    12: 'Winter', 1: 'Winter', 2: 'Winter',
+    3: 'Spring', 4: 'Spring', 5: 'Spring',
+    6: 'Summer', 7: 'Summer', 8: 'Summer',
+    9: 'Autumn', 10: 'Autumn', 11: 'Autumn'
+}
+
+
+class Rollups:
+    # Sum, count and maximum of the daily values per city x calendar month x column (species and 'api').
+    # Month-of-year and season aggregates fold these few rows instead of scanning daily data.
+    def __init__(self, cities, columns, start_period, sums, counts, maxima):
+        self.cities = cities
+        self.columns = columns
+        self.start_period = start_period
+        self.sums = sums
+        self.counts = counts
+        self.maxima = maxima
+
+    @property
+    def periods(self):
+        return pd.period_range(self.start_period, periods=self.sums.shape[1], freq='M')
+
+    def selection(self, cities, column):
+        city_idx = np.arange(len(self.cities)) if cities is None else self.cities.get_indexer(list(cities))
+        city_idx = np.sort(city_idx[city_idx >= 0])
+        if column not in self.columns:
+            return city_idx, None
+        return city_idx, self.columns.get_loc(column)
+
+    def monthly(self, cities, column, stat='mean') -> DataFrame:
+        # One row per city and "YYYY-MM" month with data: mean or max of the daily values
+        city_idx, column_idx = self.selection(cities, column)
+        if column_idx is None:
+            return pd.DataFrame(columns=['City', 'Month', column])
+        counts = self.counts[city_idx, :, column_idx]
+        if stat == 'max':
+            values = self.maxima[city_idx, :, column_idx]
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = self.sums[city_idx, :, column_idx] / counts
+        result = pd.DataFrame({
+            'City': np.repeat(self.cities[city_idx].to_numpy(), counts.shape[1]),
+            'Month': np.tile(self.periods.astype(str), len(city_idx)),
+            column: values.reshape(-1),
+        })
+        result = result[counts.reshape(-1) > 0]
+        return result.sort_values(['City', 'Month']).reset_index(drop=True)
+
+    def grouped_mean(self, cities, column, labels, order, pooled=False):
+        # Fold month periods into groups (month of year, season) and divide pooled sums by counts
+        city_idx, column_idx = self.selection(cities, column)
+        group = pd.Index(order).get_indexer(labels)
+        sums = np.zeros((len(city_idx), len(order)))
+        counts = np.zeros((len(city_idx), len(order)))
+        np.add.at(sums.T, group, self.sums[city_idx, :, column_idx].T)
+        np.add.at(counts.T, group, self.counts[city_idx, :, column_idx].T)
+        if pooled:
+            sums, counts = sums.sum(axis=0, keepdims=True), counts.sum(axis=0, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan), city_idx
+
+    def grouped_frame(self, cities, column, key, labels, order, pooled):
+        if column not in self.columns:
+            return pd.DataFrame(columns=([] if pooled else ['City']) + [key, column])
+        means, city_idx = self.grouped_mean(cities, column, labels, order, pooled)
+        if pooled:
+            result = pd.DataFrame({key: order, column: means.reshape(-1)})
+        else:
+            result = pd.DataFrame({
+                'City': np.repeat(self.cities[city_idx].to_numpy(), len(order)),
+                key: np.tile(order, len(city_idx)),
+                column: means.reshape(-1),
+            }).sort_values('City', kind='stable')
+        return result.dropna(subset=[column]).reset_index(drop=True)
+
+    def month_of_year_mean(self, cities, column, pooled=False) -> DataFrame:
+        # Mean per city (or pooled over cities) and month name, months in calendar order
+        labels = [MONTH_ORDER[p.month - 1] for p in self.periods]
+        return self.grouped_frame(cities, column, 'Month', labels, MONTH_ORDER, pooled)
+
+    def season_mean(self, cities, column, pooled=False) -> DataFrame:
+        # Mean per city (or pooled over cities) and season, seasons in alphabetical order
+        labels = [SEASONS[p.month] for p in self.periods]
+        return self.grouped_frame(cities, column, 'Season', labels, sorted(set(SEASONS.values())), pooled)
+
+    def overall_mean(self, cities, column) -> DataFrame:
+        # Mean over the whole history per city
+        city_idx, column_idx = self.selection(cities, column)
+        if column_idx is None:
+            return pd.DataFrame(columns=['City', column])
+        sums = self.sums[city_idx, :, column_idx].sum(axis=1)
+        counts = self.counts[city_idx, :, column_idx].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = pd.DataFrame({'City': self.cities[city_idx].to_numpy(), column: sums / counts})
+        return result[counts > 0].reset_index(drop=True)
+
+
+def day_periods(dates, start_period):
+    # Index of the calendar month of every day, counted from start_period
+    return (dates.year - start_period.year) * 12 + (dates.month - start_period.month)
+
+
+def build_rollups(cities, dates, species, values, api) -> Rollups:
+    # values: (city, day, species) daily medians; api: (city, day)
+    columns = pd.Index(list(species) + ['api'])
+    if len(dates) == 0:
+        empty = np.zeros((len(cities), 0, len(columns)))
+        return Rollups(cities, columns, pd.Period('2000-01', freq='M'), empty, empty.copy(), empty.copy())
+
+    start_period = dates[0].to_period('M')
+    periods = np.asarray(day_periods(dates, start_period))
+    starts = np.flatnonzero(np.r_[True, np.diff(periods) != 0])
+
+    daily = np.concatenate([np.asarray(values), np.asarray(api)[:, :, None]], axis=2)
+    observed = ~np.isnan(daily)
+    sums = np.add.reduceat(np.where(observed, daily, 0.0), starts, axis=1)
+    counts = np.add.reduceat(observed.astype(np.int64), starts, axis=1)
+    maxima = np.fmax.reduceat(daily, starts, axis=1)
+    return Rollups(cities, columns, start_period, sums, counts, maxima)
+
+
+def update_rollups(rollups: Rollups, dates, day_codes, city_codes, old, new):
+    # Apply the change of the touched (day, city) cells; old/new: (cells, columns) before and after
+    periods = np.asarray(day_periods(dates[day_codes], rollups.start_period))
+    missing = int(periods.max()) + 1 - rollups.sums.shape[1] if len(periods) else 0
+    if missing > 0:
+        pad = ((0, 0), (0, missing), (0, 0))
+        rollups.sums = np.pad(rollups.sums, pad)
+        rollups.counts = np.pad(rollups.counts, pad)
+        rollups.maxima = np.pad(rollups.maxima, pad, constant_values=np.nan)
+
+    np.add.at(rollups.sums, (city_codes, periods), np.nan_to_num(new) - np.nan_to_num(old))
+    np.add.at(rollups.counts, (city_codes, periods), (~np.isnan(new)).astype(np.int64) - (~np.isnan(old)))
+    # Values only ever get added to a cell, so maxima never decrease
+    np.fmax.at(rollups.maxima, (city_codes, periods), new)
+    return rollups
+
+
+def save_rollups(rollups: Rollups, path):
+    tmp_file = os.path.join(path, "rollups.tmp.npz")
+    np.savez(tmp_file, sums=rollups.sums, counts=rollups.counts, maxima=rollups.maxima)
+    os.replace(tmp_file, os.path.join(path, "rollups.npz"))
+    return {'start_period': str(rollups.start_period), 'columns': list(rollups.columns)}
+
+
+def open_rollups(path, meta, cities) -> Rollups:
+    with np.load(os.path.join(path, "rollups.npz")) as arrays:
+        return Rollups(
+            cities, pd.Index(meta['columns']), pd.Period(meta['start_period'], freq='M'),
+            arrays['sums'], arrays['counts'], arrays['maxima']
+        )
@@ -0,0 +1,358 @@
+import argparse
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+from pandas import DataFrame
+
+from core import compute
+from core.backtest import BACKTEST_WORKERS
+from core.correlation import CORRELATION_LAGS, city_trendline, correlation_matrix, pair_statistics
+from core.cube import REQUIRED_POLLUTANTS, open_cube
+from core.forecast import forecast_input
+from core.forecasters import DEFAULT_ENGINE, ENGINE_LABELS, GLOBAL_ENGINE
+from core.global_forecast import global_panel
+from core.jobs import JobQueue, forecast_jobs, forecast_results, forecast_tasks
+from core.memory import freeze
+from core.results_store import load_result, stored_fingerprint
+from core.store import DASHBOARD_DATA, DASHBOARD_FILTERS, country_filters, open_store, store_path, store_version
+from core.window_stats import build_window_stats
+
+# The numbers behind the General, Insights and Forecasting tabs as JSON over HTTP, without running
+# the Streamlit script. One process holds the cube, and requests are served by threads.
+# Responses are memoized per data version. The ETag is derived from the version and the request
+# alone, so a client revalidating an unchanged response gets a 304 without anything being computed.
+# Fits run in the same worker pool and model cache as the dashboard's background jobs.
+
+# Seconds between checks of the store for newly ingested rows
+REFRESH_SECONDS = 2.0
+# Serialized responses kept in memory, least recently used dropped first
+RESPONSE_CACHE_ENTRIES = 512
+SERVICE_OWNER = 'service'
+
+
+def records(frame: DataFrame):
+    # JSON-ready list of row dicts: dates in ISO format, NaN as null
+    return json.loads(frame.to_json(orient='records', date_format='iso'))
+
+
+def cities_param(cube, params):
+    # Comma-separated cities, every city when absent; unknown cities are an error
+    if 'cities' not in params:
+        return list(cube.cities)
+    cities = [city for city in params['cities'].split(',') if city]
+    unknown = [city for city in cities if city not in cube.cities]
+    if unknown:
+        raise ValueError(f"Unknown cities: {', '.join(unknown)}")
+    return cities
+
+
+def city_param(cube, params, name='city'):
+    city = params.get(name, cube.cities[0] if len(cube.cities) else None)
+    if city not in cube.cities:
+        raise ValueError(f"Unknown city: {city}")
+    return city
+
+
+def column_param(cube, params, name, default=None, api=False):
+    # A species (or 'api' where allowed) named by params[name]
+    column = params.get(name, default)
+    if column not in cube.species and not (api and column == 'api'):
+        raise ValueError(f"Unknown {name}: {column}")
+    return column
+
+
+def int_param(params, name, default, low, high):
+    value = int(params.get(name, default))
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def lag_param(params):
+    # One of the lags the pair statistics are computed for, as the Insights tab offers them
+    lag = int(params.get('lag', 0))
+    if lag not in CORRELATION_LAGS:
+        raise ValueError(f"lag must be one of {', '.join(map(str, CORRELATION_LAGS))}")
+    return lag
+
+
+def meta(service, cube, params):
+    return {
+        'version': list(cube.version),
+        'cities': list(cube.cities),
+        'species': list(cube.species),
+        'regressors': [specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS],
+        'engines': list(ENGINE_LABELS),
+        'first_date': cube.dates[0].date().isoformat() if len(cube.dates) else None,
+        'last_date': cube.dates[-1].date().isoformat() if len(cube.dates) else None,
+    }
+
+
+def monthly_api(service, cube, params):
+    return records(compute.monthly_api(cube, cities_param(cube, params)))
+
+
+def monthly_api_box(service, cube, params):
+    box_stats, outliers = compute.monthly_api_box(cube, cities_param(cube, params))
+    return {'boxes': records(box_stats), 'outliers': records(outliers)}
+
+
+def window_statistics(service, cube, params):
+    window_stats = service.derived(cube, 'window_stats', lambda: build_window_stats(open_store(service.path), cube))
+    start = params.get('start', cube.dates[0].date().isoformat() if len(cube.dates) else None)
+    end = params.get('end', cube.dates[-1].date().isoformat() if len(cube.dates) else None)
+    specie = params.get('specie', window_stats.species[0] if len(window_stats.species) else None)
+    if specie not in window_stats.species:
+        raise ValueError(f"Unknown specie: {specie}")
+    result = window_stats.query(cities_param(cube, params), specie, pd.Timestamp(start).date(), pd.Timestamp(end).date())
+    return records(result)
+
+
+def month_of_year_mean(service, cube, params):
+    pooled = params.get('pooled', 'false').lower() in ('1', 'true', 'yes')
+    result = compute.month_of_year_mean(cube, cities_param(cube, params), column_param(cube, params, 'column', 'temperature', api=True), pooled)
+    return records(result)
+
+
+def season_mean(service, cube, params):
+    return records(compute.season_mean(cube, cities_param(cube, params), column_param(cube, params, 'column', 'pm25', api=True)))
+
+
+def average_api(service, cube, params):
+    return records(compute.average_api(cube, cities_param(cube, params)))
+
+
+def specie_pair(service, cube, params):
+    x, y = column_param(cube, params, 'x', 'temperature', api=True), column_param(cube, params, 'y', 'pm10', api=True)
+    return records(compute.specie_pair(cube, city_param(cube, params), x, y))
+
+
+def correlations(service, cube, params):
+    method = params.get('method', 'pearson')
+    if method not in ('pearson', 'spearman'):
+        raise ValueError(f"Unknown method: {method}")
+    city = city_param(cube, params)
+    statistics = service.derived(cube, ('pair_statistics', city), lambda: pair_statistics(cube, cities=[city]))
+    matrix = correlation_matrix(statistics, city, method, lag_param(params))
+    return {'columns': list(matrix.columns), 'matrix': json.loads(matrix.to_json(orient='values'))}
+
+
+def pair_trendline(service, cube, params):
+    fit = city_trendline(
+        cube, city_param(cube, params), column_param(cube, params, 'x', 'temperature', api=True),
+        column_param(cube, params, 'y', 'pm10', api=True), lag_param(params)
+    )
+    return None if fit is None else {'intercept': float(fit[0]), 'slope': float(fit[1])}
+
+
+def forecast(service, cube, params):
+    # What the Forecasting tab shows: the batch job's stored result when it matches the data,
+    # else the fits from the model cache or the worker pool
+    selected_city = city_param(cube, params)
+    regressors = [specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS]
+    selected_regressor = params.get('regressor', regressors[0] if regressors else None)
+    if selected_regressor not in regressors:
+        raise ValueError(f"Unknown regressor: {selected_regressor}")
+    forecast_horizon = int_param(params, 'horizon', 30, 7, 90)
+    engine = params.get('engine', DEFAULT_ENGINE)
+    if engine not in ENGINE_LABELS:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    city_data = forecast_input(cube, selected_city, selected_regressor)
+    if city_data.empty:
+        raise ValueError(f"No API data to forecast for {selected_city}")
+    panel = None
+    if engine == GLOBAL_ENGINE:
+        panel = service.derived(cube, ('global_panel', selected_regressor), lambda: global_panel(cube, selected_regressor))
+    fingerprint = stored_fingerprint(city_data, panel)
+    stored = load_result(selected_city, selected_regressor, forecast_horizon, fingerprint, engine)
+
+    forecast_job, backtest_jobs = forecast_jobs(
+        functools.partial(service.queue.submit_task, SERVICE_OWNER), stored,
+        *forecast_tasks(city_data, selected_city, forecast_horizon, selected_regressor, engine, fingerprint, panel)
+    )
+    result, backtests = forecast_results(stored, forecast_job, backtest_jobs)
+    return {
+        'city': selected_city, 'regressor': selected_regressor, 'horizon': forecast_horizon, 'engine': engine,
+        'forecast': records(result[['ds', 'yhat']]),
+        'backtests': {
+            str(percentage): None if backtest is None else {'errors': backtest[0], 'results': records(backtest[1])}
+            for percentage, backtest in backtests.items()
+        },
+        'rolling': None if stored is None or stored['rolling'] is None else records(stored['rolling']),
+    }
+
+
+ENDPOINTS = {
+    '/meta': meta,
+    '/general/monthly_api': monthly_api,
+    '/general/monthly_api_box': monthly_api_box,
+    '/general/window_stats': window_statistics,
+    '/insights/month_of_year_mean': month_of_year_mean,
+    '/insights/season_mean': season_mean,
+    '/insights/average_api': average_api,
+    '/insights/specie_pair': specie_pair,
+    '/insights/correlations': correlations,
+    '/insights/trendline': pair_trendline,
+    '/forecast': forecast,
+}
+
+
+class QueryService:
+    # The cube of one CSV, reopened when rows are ingested, and the serialized responses of its
+    # current version
+    def __init__(self, data_path=DASHBOARD_DATA, workers=BACKTEST_WORKERS, filters=DASHBOARD_FILTERS):
+        self.data_path = data_path
+        self.filters = filters
+        self.path = store_path(data_path, filters)
+        self.queue = JobQueue(workers)
+        self.lock = threading.Lock()
+        self.cube = None
+        self.checked = 0.0
+        self.objects = {}
+        self.responses = OrderedDict()
+        self.pending = {}
+        self.refresh()
+
+    def refresh(self):
+        # Reopen the cube when the store has a new version; checked at most every REFRESH_SECONDS
+        with self.lock:
+            if self.cube is not None and time.monotonic() - self.checked < REFRESH_SECONDS:
+                return self.cube
+            version = store_version(self.data_path, self.filters)
+            self.checked = time.monotonic()
+            if self.cube is None or self.cube.version != version:
+                self.cube = freeze(open_cube(self.path))
+                self.objects = {}
+                self.responses.clear()
+            return self.cube
+
+    def derived(self, cube, name, build):
+        # Object built once per data version (window statistics, pair statistics, panels) of cube
+        version = cube.version
+        with self.lock:
+            entry = self.objects.get(name)
+        if entry is None or entry[0] != version:
+            entry = (version, freeze(build()))
+            with self.lock:
+                # A request still on a replaced cube does not evict the current version's object
+                if version == self.cube.version:
+                    self.objects[name] = entry
+        return entry[1]
+
+    def etag(self, cube, path, params):
+        key = json.dumps([list(cube.version), path, sorted(params.items())], ensure_ascii=False)
+        return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"'
+
+    def query(self, path, params):
+        # (etag, JSON body, data version) of one request; identical requests in flight are computed
+        # once. The ETag and the body come from the same cube even if a refresh swaps it meanwhile.
+        if path not in ENDPOINTS:
+            raise KeyError(path)
+        cube = self.refresh()
+        etag = self.etag(cube, path, params)
+        with self.lock:
+            body = self.responses.get(etag)
+            if body is not None:
+                self.responses.move_to_end(etag)
+                return etag, body, cube.version
+            pending = self.pending.setdefault(etag, threading.Lock())
+        with pending:
+            with self.lock:
+                body = self.responses.get(etag)
+            if body is None:
+                # Stored before the pending entry goes, so a request arriving in between finds it
+                try:
+                    body = json.dumps(ENDPOINTS[path](self, cube, params), ensure_ascii=False).encode("utf-8")
+                    with self.lock:
+                        self.responses[etag] = body
+                        while len(self.responses) > RESPONSE_CACHE_ENTRIES:
+                            self.responses.popitem(last=False)
+                finally:
+                    with self.lock:
+                        self.pending.pop(etag, None)
+        return etag, body, cube.version
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        service = self.server.service
+        if url.path not in ENDPOINTS:
+            return self.send_json(404, {'error': f"Unknown endpoint: {url.path}", 'endpoints': list(ENDPOINTS)})
+        params = dict(parse_qsl(url.query))
+        # Revalidation is answered before computing: the ETag depends on the data version only
+        etag = service.etag(service.refresh(), url.path, params)
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            etag, body, version = service.query(url.path, params)
+        except ValueError as error:
+            return self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            return self.send_json(500, {'error': str(error)})
+        self.send_body(200, body, etag, version)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def send_body(self, status, body, etag=None, version=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Data-Version', ','.join(map(str, version)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(service, host, port):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving {len(ENDPOINTS)} endpoints on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.queue.shutdown()
+
+
+if __name__ == "__main__":
+    # Serve: python -m core.service [--port 8600]; one query: python -m core.service "/insights/average_api?cities=Sibiu"
+    parser = argparse.ArgumentParser(description="JSON query service over the dashboard's aggregates and forecasts.")
+    parser.add_argument("query", nargs="?", help="print the response of one endpoint and exit, e.g. /meta")
+    parser.add_argument("--data", default=DASHBOARD_DATA)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--country", default=",".join(DASHBOARD_FILTERS['Country']),
+                        help="comma-separated countries of the partition to use, '' for the whole feed")
+    args = parser.parse_args()
+
+    query_service = QueryService(args.data, args.workers, country_filters(args.country))
+    if args.query:
+        url = urlsplit(args.query)
+        try:
+            print(query_service.query(url.path, dict(parse_qsl(url.query)))[1].decode("utf-8"))
+        finally:
+            query_service.queue.shutdown()
+    else:
+        serve(query_service, args.host, args.port)
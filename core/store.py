@@ -0,0 +1,497 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.cube import Cube, append_to_cube, build_cube, data_version, save_cube, write_cube_chunks
+from core.rollups import open_rollups, save_rollups, update_rollups
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# What the dashboard shows: the Romanian partition of its feed. The query service, report and
+# batch CLIs default to the same store, so they answer with the dashboard's numbers
+DASHBOARD_DATA = os.path.join("data", "romania_data_full.csv")
+DASHBOARD_FILTERS = {'Country': ['RO']}
+
+# Columnar copies of the CSV files live next to them, one directory per source file and filter set
+STORE_DIR = os.path.join("data", ".store")
+STORE_VERSION = 5
+
+CSV_COLUMNS = ['Date', 'Country', 'City', 'Specie', 'count', 'min', 'max', 'median', 'variance']
+CATEGORICAL_COLUMNS = ['Country', 'City', 'Specie']
+NUMERIC_COLUMNS = ['count', 'min', 'max', 'median', 'variance']
+
+# Every column is a raw little-endian file, so appending rows is a plain append to each file.
+# Rows are held in this compact schema from validation on, whether they come from a CSV or the store
+COLUMN_DTYPES = {
+    'Date': '<i8',  # datetime64[ns]
+    'Country': '<i2', 'City': '<i2', 'Specie': '<i2',  # category codes
+    'count': '<u4', 'min': '<f4', 'max': '<f4', 'median': '<f4', 'variance': '<f4',
+}
+# Counts beyond what the count column holds are stored saturated at its maximum, never rejected
+MAX_COUNT = np.iinfo(np.uint32).max
+
+# Bytes before the consumed offset that must be unchanged for the CSV to count as appended-to
+TAIL_CHECK_BYTES = 4096
+
+# Source rows parsed at a time. Ingest never holds more than one chunk of rows, so a feed larger
+# than memory streams through in bounded memory. Lines starting with '#' (the WAQI dump header) are skipped.
+CHUNK_ROWS = 250_000
+CSV_COMMENT = '#'
+
+
+def normalize_filters(filters):
+    # {'Country'|'City'|'Specie': [values], 'start'|'end': 'YYYY-MM-DD'} with empty entries dropped, or None
+    if not filters:
+        return None
+    unknown = [key for key in filters if key not in CATEGORICAL_COLUMNS + ['start', 'end']]
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(unknown)}")
+    normalized = {}
+    for key, value in filters.items():
+        if key in CATEGORICAL_COLUMNS and value:
+            normalized[key] = sorted({str(v).strip() for v in ([value] if isinstance(value, str) else value)})
+        elif key in ('start', 'end') and value:
+            normalized[key] = str(pd.Timestamp(value).date())
+    return normalized or None
+
+
+def partition_name(filters):
+    parts = [f"{key.lower()}={'+'.join(value) if isinstance(value, list) else value}" for key, value in sorted(filters.items())]
+    return re.sub(r'[^\w=+;.-]', '_', ";".join(parts))
+
+
+def store_path(csv_path, filters=None):
+    # One store per source file and filter set: a filtered store is a partition of the source,
+    # e.g. one country of a multi-country feed
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    filters = normalize_filters(filters)
+    if filters:
+        name += "@" + partition_name(filters)
+    return os.path.join(STORE_DIR, name)
+
+
+def country_filters(country):
+    # Filters of a --country option: comma-separated countries, or '' for the whole feed
+    return {'Country': country.split(",")} if country else None
+
+
+def read_chunks(source, chunk_rows=CHUNK_ROWS, **kwargs):
+    # Rows of a CSV path or file object, chunk_rows at a time
+    return pd.read_csv(source, chunksize=chunk_rows, comment=CSV_COMMENT, **kwargs)
+
+
+def read_meta(path):
+    meta_file = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(path, meta):
+    # meta.json is the commit point: columns beyond meta['rows'] are ignored until it is replaced.
+    # Every writer (process and thread) writes its own temporary file, so none renames another's away
+    tmp_file = os.path.join(path, f"meta.json.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_file, os.path.join(path, "meta.json"))
+
+
+@contextmanager
+def store_lock(path):
+    # Exclusive lock of a store across processes and threads, held while the store is appended to or
+    # swapped. The lock file sits next to the store directory, so it outlives a full re-ingest's swap.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 s; keep waiting for the other writer
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def source_state(csv_path, offset=None):
+    # Size, mtime and a hash of the bytes just before the consumed offset
+    stat = os.stat(csv_path)
+    offset = stat.st_size if offset is None else offset
+    with open(csv_path, "rb") as f:
+        f.seek(max(0, offset - TAIL_CHECK_BYTES))
+        tail = f.read(min(offset, TAIL_CHECK_BYTES))
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'offset': offset,
+            'tail_sha1': hashlib.sha1(tail).hexdigest(), 'version': STORE_VERSION}
+
+
+def validate_rows(rows: DataFrame, filters=None):
+    # Drop rows outside the filters, then rows that cannot be used: unparseable dates, missing
+    # labels or inconsistent statistics. Only the latter count as rejected.
+    missing = [column for column in CSV_COLUMNS if column not in rows.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    rows = rows[CSV_COLUMNS]
+    for column in CATEGORICAL_COLUMNS:
+        rows[column] = rows[column].astype(str).str.strip()
+    filters = normalize_filters(filters) or {}
+    # Filter pushdown: rows of other countries, cities or species are dropped before any parsing
+    for column in CATEGORICAL_COLUMNS:
+        if column in filters:
+            if column == 'Specie':
+                rows = rows[rows[column].str.lower().isin([value.lower() for value in filters[column]])]
+            else:
+                rows = rows[rows[column].isin(filters[column])]
+    rows['Date'] = pd.to_datetime(rows['Date'], errors='coerce')
+    for column in NUMERIC_COLUMNS:
+        rows[column] = pd.to_numeric(rows[column], errors='coerce')
+
+    valid = rows['Date'].notna() & rows['median'].notna() & rows['count'].notna()
+    valid &= rows['count'] >= 0
+    for column in CATEGORICAL_COLUMNS:
+        valid &= rows[column].ne('') & rows[column].ne('nan')
+    valid &= ~(rows['min'] > rows['median']) & ~(rows['median'] > rows['max'])
+    keep = valid.copy()
+    if 'start' in filters:
+        keep &= rows['Date'] >= pd.Timestamp(filters['start'])
+    if 'end' in filters:
+        keep &= rows['Date'] < pd.Timestamp(filters['end']) + pd.Timedelta(days=1)
+    rows = rows[keep]
+    rows['count'] = rows['count'].clip(upper=MAX_COUNT)
+    rows = rows.astype({column: COLUMN_DTYPES[column] for column in NUMERIC_COLUMNS})
+    return rows, int((~valid).sum())
+
+
+def compute_watermarks(rows: DataFrame, watermarks=None):
+    # Latest ingested date per city and species
+    watermarks = {city: dict(species) for city, species in (watermarks or {}).items()}
+    latest = rows.groupby(['City', 'Specie'], observed=True)['Date'].max()
+    for (city, specie), date in latest.items():
+        current = watermarks.setdefault(str(city), {}).get(str(specie))
+        if current is None or str(date.date()) > current:
+            watermarks[str(city)][str(specie)] = str(date.date())
+    return watermarks
+
+
+def newer_than_watermarks(rows: DataFrame, watermarks):
+    # Keep only rows strictly newer than the stored watermark of their city and species
+    keys = pd.Series(list(zip(rows['City'], rows['Specie'])), index=rows.index)
+    limits = keys.map(lambda key: watermarks.get(key[0], {}).get(key[1]))
+    limits = pd.to_datetime(limits)
+    return rows[limits.isna() | (rows['Date'] > limits)]
+
+
+def write_columns(rows: DataFrame, path, categories, mode):
+    for column in CSV_COLUMNS:
+        if column == 'Date':
+            values = rows['Date'].to_numpy(dtype='datetime64[ns]').view('<i8')
+        elif column in CATEGORICAL_COLUMNS:
+            values = pd.Categorical(rows[column], categories=categories[column]).codes
+        else:
+            values = rows[column].to_numpy()
+        with open(os.path.join(path, f"{column}.bin"), mode) as f:
+            f.write(np.ascontiguousarray(values, dtype=COLUMN_DTYPES[column]).tobytes())
+
+
+def truncate_columns(path, meta):
+    # Cut off bytes left behind by an append that never reached its meta.json commit
+    for column in CSV_COLUMNS:
+        with open(os.path.join(path, f"{column}.bin"), "r+b") as f:
+            f.truncate(meta['rows'] * np.dtype(COLUMN_DTYPES[column]).itemsize)
+    cube = meta['cube']
+    cells = cube['days'] * len(cube['cities'])
+    for name, size in (("cube_values.bin", cells * len(cube['species'])), ("cube_api.bin", cells)):
+        if os.path.exists(os.path.join(path, name)):
+            with open(os.path.join(path, name), "r+b") as f:
+                f.truncate(size * 8)
+
+
+class StoreWriter:
+    # Builds a store from rows arriving in chunks. Columns are appended chunk by chunk, then the cube
+    # is filled from the stored columns, again chunk by chunk, so memory stays bounded by one chunk
+    # (plus the cube itself) however many rows the source has.
+    def __init__(self, path, filters=None, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        # Each writer builds in a directory of its own, so concurrent ingests of one store (two
+        # sessions, or the dashboard and the query service) never delete each other's output
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+        self.filters = normalize_filters(filters)
+        self.chunk_rows = chunk_rows
+        for column in CSV_COLUMNS:
+            open(os.path.join(self.tmp_path, f"{column}.bin"), "wb").close()
+        # Categories grow in order of first appearance, so the cube axes need no second sort
+        self.categories = {column: [] for column in CATEGORICAL_COLUMNS}
+        self.rows = 0
+        self.rejected = 0
+        self.watermarks = {}
+        self.first, self.last = None, None
+
+    def append(self, rows: DataFrame):
+        rows, rejected = validate_rows(rows, self.filters)
+        self.rejected += rejected
+        if rows.empty:
+            return
+        for column in CATEGORICAL_COLUMNS:
+            known = set(self.categories[column])
+            self.categories[column] += [value for value in pd.unique(rows[column]) if value not in known]
+        write_columns(rows, self.tmp_path, self.categories, "ab")
+        self.rows += len(rows)
+        self.watermarks = compute_watermarks(rows, self.watermarks)
+        first, last = rows['Date'].min().normalize(), rows['Date'].max().normalize()
+        self.first = first if self.first is None else min(self.first, first)
+        self.last = last if self.last is None else max(self.last, last)
+
+    def cube_chunks(self, species):
+        # (day, city, species, median) codes of the stored rows, one chunk at a time, sliced straight
+        # from the mapped column files so only the chunk is ever read into memory
+        dates, cities, specie_codes, medians = (
+            map_column(self.tmp_path, column, self.rows) for column in ('Date', 'City', 'Specie', 'median')
+        )
+        specie_lookup = species.get_indexer([value.lower() for value in self.categories['Specie']])
+        start = np.datetime64(self.first, 'D')
+        for offset in range(0, self.rows, self.chunk_rows):
+            chunk = slice(offset, offset + self.chunk_rows)
+            days = (dates[chunk].view('datetime64[ns]').astype('datetime64[D]') - start).astype(np.int64)
+            yield days, cities[chunk], specie_lookup[specie_codes[chunk]], medians[chunk].astype(float)
+
+    def finish(self, source):
+        # Write the cube, rollups and meta, then swap the new store in
+        cities = pd.Index(self.categories['City'])
+        species = pd.Index(pd.unique(pd.Index(self.categories['Specie']).str.lower()))
+        days = 0 if self.first is None else (self.last - self.first).days + 1
+        start = None if self.first is None else str(self.first.date())
+        cube_meta, values, api = write_cube_chunks(self.tmp_path, cities, species, start, days, self.cube_chunks(species))
+        dates = pd.date_range(start, periods=days, freq='D') if days else pd.DatetimeIndex([])
+        cube = Cube(cities, dates, species, values.transpose(1, 0, 2), api.T)
+        write_meta(self.tmp_path, {
+            'source': source,
+            'filters': self.filters,
+            'rows': self.rows,
+            'rejected': self.rejected,
+            'categories': self.categories,
+            'watermarks': self.watermarks,
+            'cube': cube_meta,
+            'rollups': save_rollups(cube.rollups, self.tmp_path),
+        })
+        del cube, values, api
+
+        # Readers that already mapped the old files keep them alive until they let go. The old store
+        # is moved aside first; if a concurrent writer swapped its store in meanwhile, that one is
+        # kept and this one dropped, as both were built from the same source.
+        # The swap holds the store lock, so it never lands in the middle of an append.
+        old_path = self.tmp_path + ".old"
+        with store_lock(self.path):
+            try:
+                os.replace(self.path, old_path)
+            except FileNotFoundError:
+                pass
+            try:
+                os.replace(self.tmp_path, self.path)
+            except OSError:
+                if read_meta(self.path) is None:
+                    raise
+        shutil.rmtree(old_path, ignore_errors=True)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        return self.path
+
+
+def ingest_csv(csv_path, filters=None, chunk_rows=CHUNK_ROWS):
+    # Full ingest: stream the CSV once into typed columns and the persisted cube, keeping only the
+    # rows that pass the filters
+    writer = StoreWriter(store_path(csv_path, filters), filters, chunk_rows)
+    source = source_state(csv_path)
+    for rows in read_chunks(csv_path, chunk_rows):
+        writer.append(rows)
+    return writer.finish(source)
+
+
+def append_rows(path, rows: DataFrame, source=None):
+    # Incremental ingest: cost is proportional to the new rows, history is never re-read. Appends to
+    # one store are serialized, and the watermarks are read under the lock, so rows another writer
+    # appended meanwhile are not appended twice.
+    with store_lock(path):
+        return append_locked(path, rows, source)
+
+
+def append_locked(path, rows: DataFrame, source=None):
+    # append_rows for a caller already holding the store lock
+    meta = read_meta(path)
+    rows, rejected = validate_rows(rows, meta.get('filters'))
+    rows = newer_than_watermarks(rows, meta['watermarks'])
+    if rows.empty:
+        if source is not None:
+            write_meta(path, dict(meta, source=source))
+        return 0, rejected
+
+    truncate_columns(path, meta)
+
+    # New cities or species get new codes at the end, so existing codes stay valid
+    categories = {column: list(values) for column, values in meta['categories'].items()}
+    for column in CATEGORICAL_COLUMNS:
+        known = set(categories[column])
+        categories[column] += [value for value in pd.unique(rows[column]) if value not in known]
+    write_columns(rows, path, categories, "ab")
+
+    appended = append_to_cube(path, meta['cube'], rows)
+    if appended is None:
+        # The day-major cube cannot grow a city or species axis in place; rebuild it once
+        rebuilt = build_cube(open_store(path, rows=meta['rows'] + len(rows), categories=categories))
+        cube, rollups = save_cube(rebuilt, path), save_rollups(rebuilt.rollups, path)
+    else:
+        # Month rollups only change by the difference of the touched cells
+        cube, (day_codes, city_codes, old, new) = appended
+        rollups = open_rollups(path, meta['rollups'], pd.Index(cube['cities']))
+        dates = pd.date_range(cube['start'], periods=cube['days'], freq='D')
+        rollups = save_rollups(update_rollups(rollups, dates, day_codes, city_codes, old, new), path)
+
+    write_meta(path, dict(
+        meta,
+        source=source or meta['source'],
+        rows=meta['rows'] + len(rows),
+        rejected=meta.get('rejected', 0) + rejected,
+        categories=categories,
+        watermarks=compute_watermarks(rows, meta['watermarks']),
+        cube=cube,
+        rollups=rollups,
+    ))
+    return len(rows), rejected
+
+
+def append_csv(csv_path, new_csv_path, filters=None):
+    # Append a separate delta file (e.g. today's feed) to the store of csv_path, chunk by chunk
+    path = ensure_store(csv_path, filters)
+    added, rejected = 0, 0
+    for rows in read_chunks(new_csv_path):
+        chunk_added, chunk_rejected = append_rows(path, rows)
+        added, rejected = added + chunk_added, rejected + chunk_rejected
+    return added, rejected
+
+
+def is_current(meta, csv_path):
+    # The store was built by this version from the CSV as it is now
+    if meta is None or meta['source'].get('version') != STORE_VERSION:
+        return False
+    stat = os.stat(csv_path)
+    return stat.st_size == meta['source']['size'] and stat.st_mtime_ns == meta['source']['mtime_ns']
+
+
+def is_appended_to(meta, csv_path):
+    # The CSV only grew past the consumed offset since the store was built
+    if meta is None or meta['source'].get('version') != STORE_VERSION:
+        return False
+    source = meta['source']
+    return (os.stat(csv_path).st_size > source['offset']
+            and source_state(csv_path, source['offset'])['tail_sha1'] == source['tail_sha1'])
+
+
+def ensure_store(csv_path, filters=None):
+    # Bring the store up to date with the CSV: nothing to do, tail-append or full re-ingest
+    path = store_path(csv_path, filters)
+    meta = read_meta(path)
+    if is_current(meta, csv_path):
+        return path
+
+    # Rows appended to the end of the CSV are read from the last consumed offset only. The state is
+    # read again under the lock: another process may have appended the same tail meanwhile.
+    if is_appended_to(meta, csv_path):
+        with store_lock(path):
+            meta = read_meta(path)
+            if is_current(meta, csv_path):
+                return path
+            if is_appended_to(meta, csv_path):
+                new_source = source_state(csv_path)
+                with open(csv_path, "rb") as f:
+                    f.seek(meta['source']['offset'])
+                    for new_rows in read_chunks(f, header=None, names=CSV_COLUMNS):
+                        append_locked(path, new_rows)
+                write_meta(path, dict(read_meta(path), source=new_source))
+                return path
+
+    return ingest_csv(csv_path, filters)
+
+
+def map_column(path, column, rows):
+    # Raw values of one stored column, memory-mapped
+    if rows == 0:
+        return np.empty(0, dtype=COLUMN_DTYPES[column])
+    return np.memmap(os.path.join(path, f"{column}.bin"), dtype=COLUMN_DTYPES[column], mode='r', shape=(rows,))
+
+
+def open_store(path, rows=None, categories=None) -> DataFrame:
+    # Memory-map every column; numeric and date columns are used in place without copying
+    meta = read_meta(path)
+    rows = meta['rows'] if rows is None else rows
+    categories = meta['categories'] if categories is None else categories
+
+    # Dict order gives the CSV column order: Date, Country, City, Specie, count, ...
+    columns = {'Date': map_column(path, 'Date', rows).view('datetime64[ns]')}
+    for column in CATEGORICAL_COLUMNS:
+        columns[column] = pd.Categorical.from_codes(map_column(path, column, rows), categories[column])
+    for column in NUMERIC_COLUMNS:
+        columns[column] = map_column(path, column, rows)
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_store(csv_path, filters=None) -> DataFrame:
+    return open_store(ensure_store(csv_path, filters))
+
+
+def store_version(csv_path, filters=None):
+    # Changes whenever rows are ingested; cheap enough to call on every rerun
+    path = ensure_store(csv_path, filters)
+    return data_version(path, read_meta(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest air quality CSV files into the columnar store.")
+    parser.add_argument("csv", nargs="*", default=[os.path.join("data", "romania_data*.csv")])
+    parser.add_argument("--append", metavar="NEW_CSV", help="append the rows of NEW_CSV newer than the stored watermarks")
+    # A filtered store is a partition of the source, e.g. --country RO of a multi-country feed
+    parser.add_argument("--country", help="comma-separated countries to keep")
+    parser.add_argument("--city", help="comma-separated cities to keep")
+    parser.add_argument("--species", help="comma-separated species to keep")
+    parser.add_argument("--start", help="first date to keep (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last date to keep (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    store_filters = normalize_filters({
+        'Country': args.country and args.country.split(","),
+        'City': args.city and args.city.split(","),
+        'Specie': args.species and args.species.split(","),
+        'start': args.start,
+        'end': args.end,
+    })
+    if args.append:
+        added, rejected = append_csv(args.csv[0], args.append, store_filters)
+        print(f"{args.append}: {added} rows appended, {rejected} rejected")
+    else:
+        for pattern in args.csv:
+            for csv_path in sorted(glob.glob(pattern)):
+                print(f"{csv_path} -> {ensure_store(csv_path, store_filters)}")
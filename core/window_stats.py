@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from core.cube import Cube
+
+WINDOW_COLUMNS = ['City', 'days', 'count', 'mean', 'variance', 'std', 'min', 'max']
+
+
+class WindowStats:
+    # Constant-time statistics of any date window per city x species, from the per-day count, median,
+    # variance, min and max columns. Prefix sums over the day axis give the pooled count, mean and
+    # variance of a window as the difference of two entries; sparse tables give its min and max as
+    # the combination of two overlapping power-of-two blocks.
+    def __init__(self, cities, dates, species, days, counts, sums, squares, within, minima, maxima):
+        self.cities = cities
+        self.dates = dates
+        self.species = species
+        self.minima = minima
+        self.maxima = maxima
+        # Prefix sums, (city, day + 1, species): entry d is the total over days [0, d)
+        self.days, self.counts, self.sums, self.squares, self.within = days, counts, sums, squares, within
+        # Sparse tables are built on first use of a species, they are log2(days) times the daily data
+        self._tables = {}
+
+    def sparse_tables(self, specie):
+        if specie not in self._tables:
+            position = self.species.get_loc(specie)
+            self._tables[specie] = (
+                sparse_table(self.minima[:, :, position], np.fmin),
+                sparse_table(self.maxima[:, :, position], np.fmax),
+            )
+        return self._tables[specie]
+
+    def release(self):
+        # Drop the sparse tables; each is rebuilt on the next query of its species
+        self._tables = {}
+
+    def window(self, start, end):
+        # Day positions [first, stop) of the dates between start and end, both included
+        first = int(self.dates.searchsorted(pd.Timestamp(start)))
+        stop = int(self.dates.searchsorted(pd.Timestamp(end), side='right'))
+        return first, max(first, stop)
+
+    def query(self, cities, specie, start, end) -> DataFrame:
+        # City, days with data, observations, pooled mean, variance and std, min and max of one species
+        # over [start, end] for every city, without touching the days inside the window
+        city_idx = self.cities.get_indexer(list(cities))
+        city_idx = city_idx[city_idx >= 0]
+        first, stop = self.window(start, end)
+        if specie not in self.species or first == stop:
+            return pd.DataFrame(columns=WINDOW_COLUMNS)
+
+        position = self.species.get_loc(specie)
+
+        def total(prefix):
+            return prefix[city_idx, stop, position] - prefix[city_idx, first, position]
+
+        days, count, sums = total(self.days), total(self.counts), total(self.sums)
+        min_table, max_table = self.sparse_tables(specie)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / count
+            # Within-day sum of squares plus the spread of the day means around the window mean
+            variance = (total(self.within) + total(self.squares) - sums * mean) / (count - 1)
+        variance = np.where(count > 1, np.maximum(variance, 0.0), np.nan)
+
+        result = pd.DataFrame({
+            'City': self.cities[city_idx].to_numpy(),
+            'days': days.astype(np.int64),
+            'count': count.astype(np.int64),
+            'mean': mean,
+            'variance': variance,
+            'std': np.sqrt(variance),
+            'min': range_query(min_table, city_idx, first, stop, np.fmin),
+            'max': range_query(max_table, city_idx, first, stop, np.fmax),
+        })
+        return result[result['days'] > 0].reset_index(drop=True)
+
+
+def sparse_table(values, combine):
+    # Level k holds combine() over the 2**k days starting at every day; values: (city, day)
+    levels = [values]
+    width = 1
+    while 2 * width <= values.shape[1]:
+        previous = levels[-1]
+        levels.append(combine(previous[:, :-width], previous[:, width:]))
+        width *= 2
+    return levels
+
+
+def range_query(levels, city_idx, first, stop, combine):
+    # Two overlapping blocks of the largest power of two that fits cover [first, stop) exactly
+    level = (stop - first).bit_length() - 1
+    table = levels[level]
+    return combine(table[city_idx, first], table[city_idx, stop - (1 << level)])
+
+
+def axis_codes(axis, column, lower=False):
+    # Position of every row's label on a cube axis (-1 if absent), looking each distinct label up once
+    codes, labels = pd.factorize(column)
+    labels = pd.Index(labels).astype(str)
+    positions = axis.get_indexer(labels.str.lower() if lower else labels)
+    return np.where(codes >= 0, positions[codes], -1)
+
+
+def build_window_stats(data: DataFrame, cube: Cube) -> WindowStats:
+    # Daily store rows (count, median, variance, min, max) placed on the axes of the cube; duplicate
+    # (City, Date, Specie) rows are pooled. The median stands in for the day mean, which the feed
+    # does not carry, and variance is taken as the sample variance of the day's observations.
+    dates = pd.to_datetime(data['Date'], errors='coerce').dt.normalize()
+    city_codes = axis_codes(cube.cities, data['City'])
+    specie_codes = axis_codes(cube.species, data['Specie'], lower=True)
+    day_codes = (dates - cube.dates[0]).dt.days.to_numpy() if len(cube.dates) else np.zeros(len(data), dtype=int)
+    counts = pd.to_numeric(data['count'], errors='coerce').to_numpy(dtype=float)
+    medians = pd.to_numeric(data['median'], errors='coerce').to_numpy(dtype=float)
+    variances = pd.to_numeric(data['variance'], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+    valid = (
+        dates.notna().to_numpy() & (city_codes >= 0) & (specie_codes >= 0)
+        & (day_codes >= 0) & (day_codes < len(cube.dates)) & ~np.isnan(medians)
+    )
+    cells = (city_codes[valid], day_codes[valid].astype(np.int64), specie_codes[valid])
+    counts = np.nan_to_num(counts[valid])
+    medians, variances = medians[valid], variances[valid]
+
+    # Daily totals go one day to the right of a zero day and are summed up in place, so each
+    # prefix sum is a single array
+    shape = (len(cube.cities), len(cube.dates) + 1, len(cube.species))
+    next_day = (cells[0], cells[1] + 1, cells[2])
+    totals = {name: np.zeros(shape) for name in ('days', 'counts', 'sums', 'squares', 'within')}
+    np.add.at(totals['days'], next_day, 1.0)
+    np.add.at(totals['counts'], next_day, counts)
+    np.add.at(totals['sums'], next_day, counts * medians)
+    np.add.at(totals['squares'], next_day, counts * medians ** 2)
+    np.add.at(totals['within'], next_day, np.maximum(counts - 1, 0) * variances)
+    # Several rows of one day count that day once
+    np.minimum(totals['days'], 1.0, out=totals['days'])
+    for total in totals.values():
+        np.cumsum(total, axis=1, out=total)
+
+    # Extremes keep the float32 precision of the store columns they come from
+    shape = (len(cube.cities), len(cube.dates), len(cube.species))
+    minima, maxima = np.full(shape, np.nan, dtype=np.float32), np.full(shape, np.nan, dtype=np.float32)
+    np.fmin.at(minima, cells, pd.to_numeric(data['min'], errors='coerce').to_numpy(dtype=np.float32)[valid])
+    np.fmax.at(maxima, cells, pd.to_numeric(data['max'], errors='coerce').to_numpy(dtype=np.float32)[valid])
+
+    return WindowStats(cube.cities, cube.dates, cube.species, minima=minima, maxima=maxima, **totals)
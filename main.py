@@ -1,46 +1,99 @@
 import streamlit as st
-import pandas as pd
 
+from core.backtest import BACKTEST_WORKERS
+from core.cube import REQUIRED_POLLUTANTS, open_cube
+from core.forecasters import DEFAULT_ENGINE, ENGINE_LABELS
+from core.memory import freeze
+from core.store import DASHBOARD_DATA, DASHBOARD_FILTERS, open_store, store_path, store_version
+from core.window_stats import build_window_stats
 from tabs.air_quality_tab import build_air_quality_tab
-from tabs.forecasting_tab import build_forecasting_tab
+from tabs.forecasting_tab import build_forecasting_tab, get_job_queue
 from tabs.general_tab import build_general_tab
 from tabs.humidity_and_temp_tab import build_humidity_and_temp_tab
 from tabs.insights_tab_v2 import build_insights_tab
+from tabs.memory_panel import build_memory_panel
+from tabs.profiling import build_profiling_panel, profiled, start_rerun
 
 st.set_page_config(layout="wide")
+start_rerun()
 
-# Read CSV file (update the file path as needed)
-@st.cache_data
-def load_data(file_path):
-    return pd.read_csv(file_path)
+# Read CSV file (update the file path as needed). It is ingested once into a memory-mapped
+# columnar store, rows appended to the CSV are ingested incrementally, and the city x day x species
+# cube every tab reads slices of is persisted and updated along with it. One read-only cube per
+# process is shared by every session; its arrays map the store files, so the pages are shared
+# by the worker processes on the host as well
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_cube(file_path, filters, version):
+    return freeze(open_cube(store_path(file_path, filters)))
 
-data = load_data("data/romania_data_full.csv")
+@profiled
+def load_data(file_path, filters=None):
+    return load_cube(file_path, filters, store_version(file_path, filters))
+
+# Prefix sums and sparse tables over the daily count, median, variance, min and max rows, so the
+# statistics of any date window are answered without scanning it. Shared by every session.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_window_stats(file_path, filters, version):
+    return freeze(build_window_stats(open_store(store_path(file_path, filters)), load_cube(file_path, filters, version)))
+
+# The dashboard shows one partition of the feed: its Romanian rows. The feed is streamed in chunks
+# and other countries are dropped before their rows are parsed, so it can be any multi-country dump
+data_path = DASHBOARD_DATA
+data_filters = DASHBOARD_FILTERS
+cube = load_data(data_path, data_filters)
+window_stats = load_window_stats(data_path, data_filters, cube.version)
+
+# The fit workers start with the dashboard, so their start-up and library imports are done in the
+# background before the Forecasting tab queues its first fit
+get_job_queue(BACKTEST_WORKERS)
 
 st.title("Romania air quality")
 st.sidebar.header("Filters")
-selected_city = st.sidebar.selectbox("Select a City:", data["City"].unique())
+selected_city = st.sidebar.selectbox("Select a City:", cube.cities)
 selected_cities = st.sidebar.multiselect(
     "Select Cities:",
-    options=data['City'].unique(),
-    default=data['City'].unique()
+    options=cube.cities,
+    default=cube.cities
+)
+date_range = st.sidebar.date_input(
+    "Date range:",
+    value=(cube.dates[0].date(), cube.dates[-1].date()) if len(cube.dates) else (),
+    min_value=cube.dates[0].date() if len(cube.dates) else None,
+    max_value=cube.dates[-1].date() if len(cube.dates) else None,
 )
+# While only the first day of a new range is picked, the range runs to the end of the data
+if len(date_range) == 1 and len(cube.dates):
+    date_range = (date_range[0], cube.dates[-1].date())
 
 st.sidebar.header("Forecast settings")
 forecast_horizon = st.sidebar.slider("Forecast Horizon (days)", min_value=7, max_value=90, value=30)
-required_pollutants = ['pm10', 'pm25', 'no2', 'o3', 'so2', 'co']
-unique_values_excluding_pollutants = [specie for specie in data["Specie"].unique() if specie not in required_pollutants]
+unique_values_excluding_pollutants = [specie for specie in cube.species if specie not in REQUIRED_POLLUTANTS]
 selected_regressor = st.sidebar.selectbox("Select a regressor:", unique_values_excluding_pollutants)
+engines = list(ENGINE_LABELS)
+forecast_engine = st.sidebar.selectbox(
+    "Forecasting engine:", engines, index=engines.index(DEFAULT_ENGINE), format_func=ENGINE_LABELS.get
+)
+
+# Only the selected tab runs: switching tabs reruns the script and the other tabs are skipped
+general_tab, humidity_and_temp_tab, insights_tab, forecasting_tab = st.tabs(
+    ["General", "City", "Insights", "Forecasting"], key="selected_tab", on_change="rerun"
+)
 
-general_tab, humidity_and_temp_tab, insights_tab, forecasting_tab = st.tabs(["General", "City", "Insights", "Forecasting"])
+if humidity_and_temp_tab.open:
+    with humidity_and_temp_tab:
+        build_humidity_and_temp_tab(cube, selected_city)
 
-with humidity_and_temp_tab:
-    build_humidity_and_temp_tab(data, selected_city)
+if general_tab.open:
+    with general_tab:
+        build_general_tab(cube, selected_cities, window_stats, date_range)
 
-with general_tab:
-    build_general_tab(data, selected_cities)
+if insights_tab.open:
+    with insights_tab:
+        build_insights_tab(cube, selected_cities, selected_city)
 
-with insights_tab:
-    build_insights_tab(data, selected_cities, selected_city)
+if forecasting_tab.open:
+    with forecasting_tab:
+        build_forecasting_tab(cube, selected_city, forecast_horizon, selected_regressor, forecast_engine)
 
-with forecasting_tab:
-    build_forecasting_tab(data, selected_city, forecast_horizon, selected_regressor)
\ No newline at end of file
+build_memory_panel({'cube': cube, 'window statistics': window_stats})
+build_profiling_panel()
@@ -1,39 +1,30 @@
-from pandas import DataFrame
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 
-def build_air_quality_tab(data: DataFrame, selected_cities):
-    # Filter and clean temperature data
-    temperature_data = data[data['Specie'] == "temperature"].copy()
+from core.cube import Cube
+from tabs.cached_compute import daily_box
+from tabs.charts import box_figure
+from tabs.profiling import profiled
 
-    # Ensure 'median' is numeric and drop rows with NaN
-    temperature_data['median'] = pd.to_numeric(temperature_data['median'], errors='coerce')
-    temperature_data = temperature_data.dropna(subset=['median'])
-
-    # Convert 'Date' column to datetime format if it exists
-    if 'Date' in temperature_data.columns:
-        temperature_data['Date'] = pd.to_datetime(temperature_data['Date'], errors='coerce')
-        temperature_data = temperature_data.dropna(subset=['Date'])
-
-    filtered_temperature_data = temperature_data[temperature_data['City'].isin(selected_cities)]
+@profiled
+def build_air_quality_tab(cube: Cube, selected_cities):
+    # Quartiles and whiskers of the daily temperature of the selected cities
+    box_stats, outliers = daily_box(cube, selected_cities, "temperature")
 
     # Check if there is valid data to plot
-    if not filtered_temperature_data.empty:
+    if not box_stats.empty:
         st.subheader("Boxplot of Temperature for Different Cities")
 
-        # Create a Plotly boxplot
-        fig = px.box(
-            filtered_temperature_data,
-            x='City',
-            y='median',
-            color='City',
+        # Create a Plotly boxplot from the precomputed statistics
+        fig = box_figure(
+            box_stats,
+            outliers,
+            'City',
+            'temperature',
             title="Temperature Distribution by City",
             labels={
                 "City": "City",
-                "median": "Temperature (°C)"
-            },
-            template="plotly"
+                "temperature": "Temperature (°C)"
+            }
         )
 
         fig.update_layout(
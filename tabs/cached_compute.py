@@ -0,0 +1,31 @@
+import streamlit as st
+
+from core import compute
+from core.correlation import city_trendline as compute_city_trendline
+from core.correlation import pair_statistics as compute_pair_statistics
+from core.cube import Cube
+from core.forecast import forecast_input as compute_forecast_input
+from core.global_forecast import global_panel as compute_global_panel
+
+# Every compute function is cached on its own. The cube is keyed by its data version instead of
+# hashing its arrays, so repeat views with the same parameters are served without recomputing.
+cache_compute = st.cache_data(
+    hash_funcs={Cube: lambda cube: cube.version if cube.version is not None else id(cube)},
+    show_spinner=False,
+)
+
+monthly_api = cache_compute(compute.monthly_api)
+month_of_year_mean = cache_compute(compute.month_of_year_mean)
+season_mean = cache_compute(compute.season_mean)
+average_api = cache_compute(compute.average_api)
+specie_pair = cache_compute(compute.specie_pair)
+monthly_api_box = cache_compute(compute.monthly_api_box)
+daily_box = cache_compute(compute.daily_box)
+forecast_input = cache_compute(compute_forecast_input)
+global_panel = cache_compute(compute_global_panel)
+pair_statistics = cache_compute(compute_pair_statistics)
+city_trendline = cache_compute(compute_city_trendline)
+
+# Results that grow with the history: day-level rows. These are what the memory budget sheds; the
+# month and season aggregates and one city's pair statistics are a few KB each.
+LARGE_RESULTS = [specie_pair, forecast_input, global_panel]
@@ -0,0 +1,233 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+from pandas import DataFrame
+
+from core.compute import density_bins, lttb, ols_line
+
+# Upper bounds on what a figure sends to the browser, however long the history
+MAX_SCATTER_POINTS = 5000
+DENSITY_BINS = 80
+MAX_LINE_POINTS = 2000
+
+
+def box_figure(stats: DataFrame, outliers: DataFrame, group, value, title, labels):
+    # One precomputed box per group, coloured like px.box(color=group), with its outliers as points
+    fig = go.Figure(layout={'template': 'plotly', 'title': {'text': title}})
+    colors = px.colors.qualitative.Plotly
+    for position, box in enumerate(stats.itertuples(index=False)):
+        name = getattr(box, group)
+        color = colors[position % len(colors)]
+        fig.add_trace(go.Box(
+            x=[name], q1=[box.q1], median=[box.median], q3=[box.q3],
+            lowerfence=[box.lowerfence], upperfence=[box.upperfence], mean=[box.mean],
+            name=str(name), legendgroup=str(name), marker_color=color, boxpoints=False
+        ))
+        points = outliers.loc[outliers[group] == name, value]
+        if len(points):
+            fig.add_trace(go.Scattergl(
+                x=[name] * len(points), y=points, mode='markers', name=str(name), legendgroup=str(name),
+                marker_color=color, showlegend=False
+            ))
+    fig.update_layout(xaxis_title=labels.get(group, group), yaxis_title=labels.get(value, value), legend_title_text=labels.get(group, group))
+    return fig
+
+
+def scatter_figure(data: DataFrame, x, y, title, labels, color=None, trendline=None):
+    # WebGL scatter with an OLS trendline drawn from stored (intercept, slope) coefficients, or fitted
+    # here when none are given. Above MAX_SCATTER_POINTS the points are binned into a density heatmap,
+    # so the payload stays bounded.
+    if len(data) <= MAX_SCATTER_POINTS:
+        fig = px.scatter(
+            data, x=x, y=y, title=title, labels=labels, render_mode="webgl",
+            color_discrete_sequence=[color] if color else None
+        )
+    else:
+        x_centres, y_centres, counts = density_bins(data[x], data[y], DENSITY_BINS)
+        fig = go.Figure(layout={'title': {'text': title}})
+        fig.add_trace(go.Heatmap(
+            x=x_centres, y=y_centres, z=np.where(counts > 0, counts, np.nan), colorscale="Blues",
+            colorbar={'title': {'text': "Days"}}, name="Density"
+        ))
+        fig.update_layout(xaxis_title=labels.get(x, x), yaxis_title=labels.get(y, y))
+
+    if data[x].nunique() >= 2:
+        if trendline is None:
+            line_x, line_y = ols_line(data[x], data[y])
+        else:
+            intercept, slope = trendline
+            line_x = np.array([data[x].min(), data[x].max()], dtype=float)
+            line_y = intercept + slope * line_x
+        fig.add_trace(go.Scattergl(
+            x=line_x, y=line_y, mode="lines", name="OLS trendline", showlegend=False,
+            line_color=color or px.colors.qualitative.Plotly[0]
+        ))
+    return fig
+
+
+def downsample(data: DataFrame, x, y, max_points=MAX_LINE_POINTS) -> DataFrame:
+    # Shape-preserving subset of a long time series (LTTB)
+    if len(data) <= max_points:
+        return data
+    return data.iloc[lttb(data[x], data[y], max_points)]
+
+
+# Figures of the tabs, shared with the static reports (python -m core.report)
+MONTHS = ["January", "February", "March", "April", "May", "June",
+          "July", "August", "September", "October", "November", "December"]
+
+
+def monthly_api_box_figure(box_stats: DataFrame, outliers: DataFrame):
+    fig = box_figure(
+        box_stats,
+        outliers,
+        'city',
+        'api',
+        title="Air Pollution Index (API)",
+        labels={
+            "city": "City",
+            "api": "Air Pollution Index (API)"
+        }
+    )
+    fig.update_layout(
+        xaxis_title="City",
+        yaxis_title="API",
+        xaxis_tickangle=45  # Rotate city labels
+    )
+    return fig
+
+
+def monthly_api_figure(data: DataFrame):
+    fig = px.bar(
+        data,
+        x='month',
+        y='api',
+        color='city',
+        barmode='group',
+        title="Monthly Air Pollution Index (API) by City",
+        labels={"month": "Month", "api": "Air Pollution Index (API)", "city": "City"}
+    )
+    fig.update_layout(xaxis={'categoryorder': 'category ascending'})
+    return fig
+
+
+def monthly_bar_figure(monthly, label, title, color):
+    # Bar per month of a month-indexed series, as in the City tab
+    fig = px.bar(
+        x=monthly.index,
+        y=monthly.values,
+        labels={"x": "Month", "y": label},
+        title=title,
+        color_discrete_sequence=[color]
+    )
+    fig.update_layout(xaxis_title="Month", yaxis_title=label)
+    return fig
+
+
+def temperature_scatter_figure(data: DataFrame, specie, color, trendline=None):
+    # Daily temperature against one particulate species, with its regression line
+    name = specie.upper()
+    return scatter_figure(
+        data.rename(columns={'temperature': 'Temperature', specie: name}),
+        x="Temperature",
+        y=name,
+        labels={"Temperature": "Temperature (°C)", name: f"{name} (µg/m³)"},
+        title=f"Temperature vs {name} with Regression Line",
+        color=color,
+        trendline=trendline
+    )
+
+
+def month_of_year_figure(data: DataFrame, pollutant):
+    return px.line(
+        data,
+        x="Month",
+        y=pollutant,
+        color="City",
+        title=f"Monthly Average {pollutant.upper()} Levels Across Cities",
+        labels={pollutant: f"{pollutant.upper()} (µg/m³)", "Month": "Month"}
+    )
+
+
+def monthly_temperature_figure(data: DataFrame, title, color=None):
+    fig = px.bar(
+        data,
+        x="Month",
+        y="temperature",
+        color=color,
+        title=title,
+        labels={"temperature": "Temperature (°C)", "Month": "Month"}
+    )
+    # Months in calendar order
+    fig.update_xaxes(categoryorder="array", categoryarray=MONTHS)
+    return fig
+
+
+def pollutant_temperature_figure(data: DataFrame, pollutant, selected_city, trendline=None):
+    return scatter_figure(
+        data,
+        x=pollutant,
+        y="temperature",
+        title=f"Correlation Between {pollutant.upper()} and Temperature in {selected_city}",
+        labels={pollutant: f"{pollutant.upper()} (µg/m³)", "temperature": "Temperature (°C)"},
+        trendline=trendline,
+    )
+
+
+def correlation_figure(matrix: DataFrame, method, lag, selected_city):
+    return px.imshow(
+        matrix,
+        zmin=-1,
+        zmax=1,
+        color_continuous_scale="RdBu_r",
+        text_auto=".2f",
+        aspect="auto",
+        title=f"{method.capitalize()} Correlation Between All Species in {selected_city}",
+        labels={"x": f"Day + {lag}", "y": "Day", "color": method.capitalize()}
+    )
+
+
+def average_api_figure(data: DataFrame):
+    return px.bar(
+        data,
+        x="city",
+        y="api",
+        title="Average Air Pollution Index (API) by City",
+        labels={"api": "Average API", "city": "City"}
+    )
+
+
+def season_figure(data: DataFrame, pollutant):
+    return px.bar(
+        data,
+        x="City",
+        y=pollutant,
+        color="Season",
+        title=f"Average {pollutant.upper()} Levels in Winter vs Summer",
+        labels={pollutant: f"{pollutant.upper()} (µg/m³)", "City": "City", "Season": "Season"}
+    )
+
+
+def forecast_figure(forecast: DataFrame, city_data: DataFrame, selected_city, selected_regressor):
+    # Forecast line over the historical API; long histories are downsampled to a bounded number of points
+    fig = px.line(
+        downsample(forecast, 'ds', 'yhat'),
+        x='ds',
+        y='yhat',
+        title=f"Air Pollution Index Forecast for {selected_city} with {selected_regressor} as regressor",
+        labels={"yhat": "Forecasted API", "ds": "Date"}
+    )
+    history = downsample(city_data, 'ds', 'y')
+    fig.add_scattergl(x=history['ds'], y=history['y'], mode='markers', name='Historical API')
+    return fig
+
+
+def backtest_figure(results_df: DataFrame, percentage):
+    # Actual against predicted API of one split backtest
+    return px.line(
+        results_df,
+        x='Date',
+        y=['Actual', 'Predicted'],
+        title=f"Backtest with {int(percentage * 100)}% Training Data",
+        labels={"value": "API", "variable": ""}
+    )
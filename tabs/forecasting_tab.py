@@ -1,147 +1,137 @@
-from pandas import DataFrame
+import functools
+import uuid
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error
-from prophet import Prophet
-
-def perform_backtest_with_percentage(data: pd.DataFrame, train_percentage: float, forecast_horizon: int, selected_regressor):
-    data['ds'] = pd.to_datetime(data['ds'])
-    data = data.sort_values(by='ds')
-
-    # Define training and test sizes
-    train_size = int(len(data) * train_percentage)
-    train_data = data.iloc[:train_size]
-    test_data = data.iloc[train_size:train_size + forecast_horizon]
-
-    # Train the Prophet model
-    model = Prophet()
-    model.add_regressor(selected_regressor)
-    model.fit(train_data)
-
-    # Forecast the test period
-    future = model.make_future_dataframe(periods=forecast_horizon, freq='D')
-    future[selected_regressor] = data[selected_regressor].iloc[-1]
-    forecast = model.predict(future)
-
-    # Extract forecasted values
-    forecasted_values = forecast[['ds', 'yhat']].set_index('ds').loc[test_data['ds']].reset_index()
-    predicted_y = forecasted_values['yhat'].values
-    actual_y = test_data['y'].values
-
-    # Calculate errors
-    mae = mean_absolute_error(actual_y, predicted_y)
-    mape = mean_absolute_percentage_error(actual_y, predicted_y) * 100  # in percentage
-
-    # Store results in a DataFrame
-    results_df = pd.DataFrame({
-        'Date': test_data['ds'],
-        'Actual': actual_y,
-        'Predicted': predicted_y
-    })
-
-    errors = {'MAE': mae, 'MAPE': mape}
-    return errors, results_df
-
-def build_forecasting_tab(data: DataFrame, selected_city, forecast_horizon, selected_regressor):
-    st.title("Romania Air Quality Forecasting")
-
-    # Extract Romania data
-    romania_data = data.copy()
 
-    # Convert 'Date' column to datetime format and drop invalid dates
-    romania_data['Date'] = pd.to_datetime(romania_data['Date'], errors='coerce')
-    romania_data = romania_data.dropna(subset=['Date'])
+from core.backtest import BACKTEST_WORKERS
+from core.cube import Cube
+from core.forecast import TRAINING_PERCENTAGES
+from core.forecasters import ENGINE_LABELS, GLOBAL_ENGINE
+from core.jobs import JobQueue, forecast_jobs, forecast_tasks
+from core.results_store import load_result, stored_fingerprint
+from tabs.cached_compute import forecast_input, global_panel
+from tabs.charts import forecast_figure
+from tabs.profiling import profiled
+
+# Seconds between checks of running jobs; only the job results area reruns
+JOB_POLL_SECONDS = 1.0
+
+@st.cache_resource
+def get_job_queue(workers):
+    # One queue and worker pool per process, shared by every session
+    return JobQueue(workers)
+
+def job_owner():
+    # Jobs belong to a session, so its newer parameters supersede its older jobs
+    return st.session_state.setdefault("job_owner", uuid.uuid4().hex)
+
+def submit_forecast_jobs(city_data: pd.DataFrame, selected_city, forecast_horizon: int, selected_regressor, engine, fingerprint, stored=None, panel=None):
+    # Forecast job (None when precomputed) and {percentage: backtest job} for the splits not precomputed
+    queue = get_job_queue(BACKTEST_WORKERS)
+    owner = job_owner()
+    forecast_job, backtest_jobs = forecast_jobs(
+        functools.partial(queue.submit_task, owner), stored,
+        *forecast_tasks(city_data, selected_city, forecast_horizon, selected_regressor, engine, fingerprint, panel)
+    )
+    queue.supersede(owner, [job for job in [forecast_job, *backtest_jobs.values()] if job is not None])
+    return forecast_job, backtest_jobs
+
+def show_forecast_results(city_data: pd.DataFrame, selected_city, selected_regressor, stored, forecast_job, backtest_jobs):
+    # Everything that is ready; jobs still queued or running are shown as such
+    if stored is not None:
+        forecast = stored['forecast']
+    elif forecast_job.state == 'done':
+        forecast = forecast_job.result()['forecast']
+    else:
+        forecast = None
 
-    # Extract 'Day' for better precision
-    romania_data['Date'] = romania_data['Date'].dt.to_period('D').astype(str)
+    if forecast is not None:
+        # Plot forecast results over the historical data
+        fig = forecast_figure(forecast, city_data, selected_city, selected_regressor)
 
-    # Required pollutants for API calculation
-    required_pollutants = ['pm10', 'pm25', 'no2', 'o3', 'so2', 'co']
+        # Display Plot
+        st.plotly_chart(fig)
+    elif forecast_job.state == 'failed':
+        st.warning(f"The forecast for {selected_city} could not be fitted.")
+    else:
+        st.write(f"Forecast: {forecast_job.state}")
 
-    # Filter data for required pollutants
-    api_data = romania_data[romania_data['Specie'].str.lower().isin(required_pollutants + [selected_regressor])].copy()
+    # Scenarios: Define training percentages
+    training_percentages = TRAINING_PERCENTAGES  # 30%, 50%, 70%, and 90% of the data
+    # Backtesting for each scenario
+    st.subheader("Backtesting Results for Different Training Data Percentages")
 
-    # Pivot pollutants into columns
-    pivot_data = api_data.pivot_table(
-        index=['City', 'Date'],
-        columns='Specie',
-        values='median',
-        aggfunc='max'
-    ).reset_index()
+    failed = False
+    for percentage in training_percentages:
+        st.write(f"### Scenario: {int(percentage * 100)}% Training Data")
+        job = backtest_jobs.get(percentage)
+        if job is None:
+            errors, results_df = stored['backtests'][percentage]
+        elif job.state == 'done':
+            errors, results_df = job.result()
+        else:
+            failed = failed or job.state == 'failed'
+            if job.state != 'failed':
+                st.write(f"Backtest: {job.state}")
+            continue
+        # Display errors
+        st.write(f"**MAE**: {errors['MAE']:.2f}")
+        st.write(f"**MAPE**: {errors['MAPE']:.2f}%")
+        if 'Fit time' in errors:
+            st.write(f"**Fit time**: {errors['Fit time']:.2f} s")
+        # Plot actual vs predicted
+        st.line_chart(results_df.set_index('Date'))
+
+    if failed:
+        st.write(f"Sorry there is not enough data to do backtesting with selected regressor: {selected_regressor} 30%, 50%, 70% and 90% data")
 
-    # Clean up column names
-    pivot_data.columns.name = None
-    pivot_data.columns = [col.lower() if isinstance(col, str) else col for col in pivot_data.columns]
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_forecast_jobs(city_data: pd.DataFrame, selected_city, selected_regressor, stored, forecast_job, backtest_jobs):
+    # Progress and partial results while jobs run; once all have finished the page reruns in full
+    jobs = [job for job in [forecast_job, *backtest_jobs.values()] if job is not None]
+    finished = sum(job.future.done() for job in jobs)
+    if finished == len(jobs):
+        st.rerun()
+    st.progress(finished / len(jobs), text=f"{finished} of {len(jobs)} fits finished")
+    show_forecast_results(city_data, selected_city, selected_regressor, stored, forecast_job, backtest_jobs)
+
+@profiled
+def build_forecasting_tab(cube: Cube, selected_city, forecast_horizon, selected_regressor, engine):
+    st.title("Romania Air Quality Forecasting")
 
-    # Dynamically calculate API
-    available_pollutants = [col for col in required_pollutants if col in pivot_data.columns]
-    if available_pollutants:
-        pivot_data['api'] = pivot_data[available_pollutants].max(axis=1, skipna=True)
-    else:
+    if not cube.available_pollutants():
         st.write("No pollutants available for API calculation.")
-        pivot_data['api'] = None
 
     ### Forecasting Section ###
-    st.subheader("Air Pollution Index Forecasting with Prophet")
+    st.subheader(f"Air Pollution Index Forecasting with {ENGINE_LABELS[engine]}")
 
-    # Filter data for the selected city
-    city_data = pivot_data[pivot_data['city'] == selected_city]
+    # Prepare data for Prophet from the selected city's slice of the shared cube
+    city_data = forecast_input(cube, selected_city, selected_regressor)
 
     # Check if sufficient data exists
-    if city_data.empty or city_data['api'].isna().all():
+    if city_data.empty:
         st.warning(f"No sufficient API data available for forecasting in {selected_city}.")
         return
-    # Prepare data for Prophet
-    city_data = city_data[['date', 'api', selected_regressor]].dropna()
-    city_data['date'] = pd.to_datetime(city_data['date'])
-    city_data = city_data.rename(columns={"date": "ds", "api": "y"})
-
-    # Train the Prophet model
-
-    model = Prophet()
-    model.add_regressor(selected_regressor)
-    model.fit(city_data)
-
-    # Generate future dates for prediction (e.g., next 30 days)
-    future = model.make_future_dataframe(periods=forecast_horizon, freq='D')
-    future[selected_regressor] = city_data[selected_regressor].iloc[-1]
-
-    forecast = model.predict(future)
-
-    # Plot forecast results
-    fig = px.line(
-        forecast,
-        x='ds',
-        y='yhat',
-        title=f"Air Pollution Index Forecast for {selected_city} with {selected_regressor} as regressor",
-        labels={"yhat": "Forecasted API", "ds": "Date"}
-    )
-
-    # Overlay historical data
-    fig.add_scatter(x=city_data['ds'], y=city_data['y'], mode='markers', name='Historical API')
 
-    # Display Plot
-    st.plotly_chart(fig)
-
-    # Scenarios: Define training percentages
-    training_percentages = [0.3, 0.5, 0.7, 0.9]  # 50%, 70%, and 90% of the data
-    # Backtesting for each scenario
-    st.subheader("Backtesting Results for Different Training Data Percentages")
+    # Serve the batch job's precomputed result; on a miss the fits are queued in background
+    # workers, reusing the fits cached for the same city, regressor, horizon, data and engine
+    panel = global_panel(cube, selected_regressor) if engine == GLOBAL_ENGINE else None
+    fingerprint = stored_fingerprint(city_data, panel)
+    stored = load_result(selected_city, selected_regressor, forecast_horizon, fingerprint, engine)
+    forecast_job, backtest_jobs = submit_forecast_jobs(
+        city_data, selected_city, forecast_horizon, selected_regressor, engine, fingerprint, stored, panel
+    )
+    jobs = [job for job in [forecast_job, *backtest_jobs.values()] if job is not None]
+    if all(job.future.done() for job in jobs):
+        show_forecast_results(city_data, selected_city, selected_regressor, stored, forecast_job, backtest_jobs)
+    else:
+        poll_forecast_jobs(city_data, selected_city, selected_regressor, stored, forecast_job, backtest_jobs)
 
-    try:
-        for percentage in training_percentages:
-            st.write(f"### Scenario: {int(percentage * 100)}% Training Data")
-            errors, results_df = perform_backtest_with_percentage(
-                data=city_data, train_percentage=percentage, forecast_horizon=forecast_horizon, selected_regressor=selected_regressor
-            )
-            # Display errors
-            st.write(f"**MAE**: {errors['MAE']:.2f}")
-            st.write(f"**MAPE**: {errors['MAPE']:.2f}%")
-            # Plot actual vs predicted
-            st.line_chart(results_df.set_index('Date'))
-    except:
-        st.write(f"Sorry there is not enough data to do backtesting with selected regressor: {selected_regressor} 30%, 50%, 70% and 90% data")
+    # Rolling-origin error per horizon step, when the batch job was run with --rolling
+    if stored is not None and stored['rolling'] is not None:
+        st.subheader("Rolling-Origin Evaluation")
+        st.dataframe(stored['rolling'], hide_index=True)
 
     st.subheader("Conclusion:")
     st.subheader("How well does the Prophet model forecast API under different training data scenarios?​")
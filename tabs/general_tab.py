@@ -1,46 +1,18 @@
-from pandas import DataFrame
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 
-def build_api_boxplot(data: DataFrame, selected_cities):
-    romania_data = data.copy()
+from core.cube import Cube
+from core.window_stats import WindowStats
+from tabs.cached_compute import monthly_api, monthly_api_box
+from tabs.charts import monthly_api_box_figure, monthly_api_figure
+from tabs.profiling import profiled
 
-    # Convert 'Date' column to datetime format and drop invalid dates
-    romania_data['Date'] = pd.to_datetime(romania_data['Date'], errors='coerce')
-    romania_data = romania_data.dropna(subset=['Date'])
-
-    # Extract 'Month' in "YYYY-MM" format
-    romania_data['Month'] = romania_data['Date'].dt.to_period('M').astype(str)
-
-    # List of required pollutants for API calculation
-    required_pollutants = ['pm10', 'pm25', 'no2', 'o3', 'so2', 'co']
-
-    # Filter data to include only rows for the required pollutants
-    api_data = romania_data[romania_data['Specie'].str.lower().isin(required_pollutants)].copy()
-
-    # Pivot the data so pollutants become columns
-    pivot_data = api_data.pivot_table(
-        index=['City', 'Month'],
-        columns='Specie',
-        values='median',
-        aggfunc='max'
-    ).reset_index()
-
-    # Clean up column names
-    pivot_data.columns.name = None
-    pivot_data.columns = [col.lower() if isinstance(col, str) else col for col in pivot_data.columns]
-
-    # Dynamically calculate API as the maximum value across the available pollutants
-    available_pollutants = [col for col in required_pollutants if col in pivot_data.columns]
-    if available_pollutants:
-        pivot_data['api'] = pivot_data[available_pollutants].max(axis=1, skipna=True)
-    else:
+@profiled
+def build_api_boxplot(cube: Cube, selected_cities):
+    if not cube.available_pollutants():
         st.write("No pollutants available for API calculation.")
-        pivot_data['api'] = None
 
-    # Filter the data based on selected cities
-    filtered_data = pivot_data[pivot_data['city'].isin(selected_cities)]
+    # Quartiles and whiskers of the monthly API of the selected cities
+    box_stats, outliers = monthly_api_box(cube, selected_cities)
 
     # # # Display API results in a table
     # # st.subheader("Air Pollution Index (API) Results")
@@ -51,76 +23,50 @@ def build_api_boxplot(data: DataFrame, selected_cities):
     #     st.write("No valid API data available to display.")
 
     # Check if there is valid data to plot
-    if not filtered_data.empty:
+    if not box_stats.empty:
         st.subheader("Boxplot of Air Pollution Index (API) for Different Cities")
 
-        # Create a Plotly boxplot
-        fig = px.box(
-            filtered_data,
-            x='city',
-            y='api',
-            color='city',
-            title="Air Pollution Index (API)",
-            labels={
-                "city": "City",
-                "api": "Air Pollution Index (API)"
-            },
-            template="plotly"
-        )
-
-        fig.update_layout(
-            xaxis_title="City",
-            yaxis_title="API",
-            xaxis_tickangle=45  # Rotate city labels
-        )
+        # Create a Plotly boxplot from the precomputed statistics
+        fig = monthly_api_box_figure(box_stats, outliers)
 
         # Display the plot in Streamlit
         st.plotly_chart(fig, key="sadsdaasdasdasdz")
     else:
         st.write("No temperature data available for boxplot.")
 
-def build_general_tab(data: DataFrame, selected_cities):
+@st.fragment
+@profiled
+def build_window_statistics(window_stats: WindowStats, selected_cities, date_range):
+    # Pooled statistics of one species over the sidebar date range, answered from prefix sums and
+    # sparse tables, so changing the range or the species does not rescan the history
+    if len(date_range) != 2:
+        return
+    start, end = date_range
+    st.subheader(f"Statistics from {start} to {end}")
+    specie = st.selectbox("Select a species:", window_stats.species, key="window_specie")
+    result = window_stats.query(selected_cities, specie, start, end)
+    if not result.empty:
+        st.dataframe(
+            result.drop(columns='variance').rename(columns={
+                'days': 'Days', 'count': 'Observations', 'mean': 'Mean', 'std': 'Std', 'min': 'Min', 'max': 'Max'
+            }),
+            hide_index=True
+        )
+    else:
+        st.write("No data available for the selected cities and dates.")
+
+@profiled
+def build_general_tab(cube: Cube, selected_cities, window_stats: WindowStats, date_range):
     # Streamlit App
     st.title("Air Pollution Index (API) by City and Month")
-    build_api_boxplot(data, selected_cities)
-
-    romania_data = data.copy()
-
-    # Convert 'Date' column to datetime format and drop invalid dates
-    romania_data['Date'] = pd.to_datetime(romania_data['Date'], errors='coerce')
-    romania_data = romania_data.dropna(subset=['Date'])
-
-    # Extract 'Month' in "YYYY-MM" format
-    romania_data['Month'] = romania_data['Date'].dt.to_period('M').astype(str)
+    build_api_boxplot(cube, selected_cities)
+    build_window_statistics(window_stats, selected_cities, date_range)
 
-    # List of required pollutants for API calculation
-    required_pollutants = ['pm10', 'pm25', 'no2', 'o3', 'so2', 'co']
-
-    # Filter data to include only rows for the required pollutants
-    api_data = romania_data[romania_data['Specie'].str.lower().isin(required_pollutants)].copy()
-
-    # Pivot the data so pollutants become columns
-    pivot_data = api_data.pivot_table(
-        index=['City', 'Month'],
-        columns='Specie',
-        values='median',
-        aggfunc='max'
-    ).reset_index()
-
-    # Clean up column names
-    pivot_data.columns.name = None
-    pivot_data.columns = [col.lower() if isinstance(col, str) else col for col in pivot_data.columns]
-
-    # Dynamically calculate API as the maximum value across the available pollutants
-    available_pollutants = [col for col in required_pollutants if col in pivot_data.columns]
-    if available_pollutants:
-        pivot_data['api'] = pivot_data[available_pollutants].max(axis=1, skipna=True)
-    else:
+    if not cube.available_pollutants():
         st.write("No pollutants available for API calculation.")
-        pivot_data['api'] = None
 
     # Filter the data based on selected cities
-    filtered_data = pivot_data[pivot_data['city'].isin(selected_cities)]
+    filtered_data = monthly_api(cube, selected_cities)
 
     # # Display API results in a table
     # st.subheader("Air Pollution Index (API) Results")
@@ -133,16 +79,7 @@ def build_general_tab(data: DataFrame, selected_cities):
     # Visualize API results as a bar chart
     st.subheader("Air Pollution Index (API) Visualization")
     if not filtered_data.empty:
-        fig = px.bar(
-            filtered_data,
-            x='month',
-            y='api',
-            color='city',
-            barmode='group',
-            title="Monthly Air Pollution Index (API) by City",
-            labels={"month": "Month", "api": "Air Pollution Index (API)", "city": "City"}
-        )
-        fig.update_layout(xaxis={'categoryorder': 'category ascending'})
+        fig = monthly_api_figure(filtered_data)
         st.plotly_chart(fig)
     else:
         st.write("No data available for the selected cities.")
\ No newline at end of file
@@ -0,0 +1,33 @@
+import streamlit as st
+
+from core.memory import MEMORY_BUDGET_BYTES, MemoryBudget, memory_report, process_anonymous
+from tabs.cached_compute import LARGE_RESULTS
+
+
+@st.cache_resource
+def get_memory_budget():
+    # One trigger per process, shared by every session
+    return MemoryBudget()
+
+
+def enforce_memory_budget(shared):
+    # Once per crossing of the budget, drop the large results that can be rebuilt: memoized
+    # day-level tab results and lazily built indexes. Returns whether anything was shed.
+    if not get_memory_budget().crossed():
+        return False
+    for cached in LARGE_RESULTS:
+        cached.clear()
+    for obj in shared.values():
+        if hasattr(obj, 'release'):
+            obj.release()
+    return True
+
+
+def build_memory_panel(shared):
+    # Process memory against the budget and what the objects shared by every session hold
+    shed = enforce_memory_budget(shared)
+    with st.sidebar.expander("Memory", expanded=False):
+        st.write(f"Process heap: {process_anonymous() / 2 ** 20:.0f} MB of {MEMORY_BUDGET_BYTES / 2 ** 20:.0f} MB budget")
+        if shed:
+            st.warning("Over the memory budget: large cached results were released.")
+        st.dataframe(memory_report(shared).round(1), hide_index=True)
@@ -0,0 +1,117 @@
+import cProfile
+import functools
+import json
+import marshal
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+# Opt-in: AIRQUALITY_PROFILE=1 streamlit run main.py. Without it the hooks only cost a dict lookup
+PROFILING_ENABLED = os.environ.get("AIRQUALITY_PROFILE", "0") == "1"
+
+
+class RerunProfile:
+    # Wall time, CPU time and peak traced allocation of every profiled section of one rerun
+    def __init__(self, cprofile=True):
+        self.sections = []
+        self.stack = []
+        self.profiler = cProfile.Profile() if cprofile else None
+
+    @contextmanager
+    def section(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.stack:
+            # The peak counter is shared, so keep the parent's peak before resetting it for the child
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        elif self.profiler is not None:
+            self.profiler.enable()
+        tracemalloc.reset_peak()
+
+        record = {'section': name, 'depth': len(self.stack), 'wall_seconds': None, 'cpu_seconds': None, 'peak_bytes': None}
+        self.sections.append(record)
+        frame = {'peak': 0, 'start': tracemalloc.get_traced_memory()[0]}
+        self.stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            self.stack.pop()
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_bytes'] = peak - frame['start']
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            elif self.profiler is not None:
+                self.profiler.disable()
+
+    def to_frame(self):
+        return pd.DataFrame(self.sections, columns=['section', 'depth', 'wall_seconds', 'cpu_seconds', 'peak_bytes'])
+
+    def to_json(self):
+        return json.dumps({'sections': self.sections}, indent=2)
+
+    def to_pstats(self):
+        # Same bytes cProfile.Profile.dump_stats writes; open with pstats.Stats or snakeviz
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+
+def current_profile():
+    if not PROFILING_ENABLED:
+        return None
+    return st.session_state.setdefault("rerun_profile", RerunProfile())
+
+
+def start_rerun():
+    # Called at the top of main.py; fragment reruns add their sections to the last full rerun
+    if PROFILING_ENABLED:
+        st.session_state["rerun_profile"] = RerunProfile()
+
+
+@contextmanager
+def section(name):
+    profile = current_profile()
+    if profile is None:
+        yield
+    else:
+        with profile.section(name):
+            yield
+
+
+def profiled(func):
+    # Record every call of func as a section named module.function
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with section(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def build_profiling_panel():
+    profile = current_profile()
+    if profile is None:
+        return
+
+    with st.sidebar.expander("Performance", expanded=False):
+        sections = profile.to_frame()
+        if sections.empty:
+            st.write("No profiled sections ran.")
+            return
+        sections['section'] = ["  " * depth + name for name, depth in zip(sections['section'], sections['depth'])]
+        sections['peak_mb'] = sections['peak_bytes'] / 2 ** 20
+        st.dataframe(
+            sections[['section', 'wall_seconds', 'cpu_seconds', 'peak_mb']].round(3),
+            hide_index=True
+        )
+        top_level = sections[sections['depth'] == 0]
+        st.write(f"Total: {top_level['wall_seconds'].sum():.2f} s wall, {top_level['cpu_seconds'].sum():.2f} s CPU")
+        st.download_button("Export JSON", profile.to_json(), file_name="rerun_profile.json", mime="application/json")
+        st.download_button("Export cProfile", profile.to_pstats(), file_name="rerun_profile.prof")
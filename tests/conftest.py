@@ -0,0 +1,32 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# The sample shipped with the repository
+SAMPLE_CSV = os.path.join(REPO_DIR, "data", "romania_data.csv")
+
+
+@pytest.fixture
+def sample_csv(tmp_path, monkeypatch):
+    # The sample CSV in a scratch working directory, so its store and caches start empty
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    path = os.path.join("data", "romania_data.csv")
+    shutil.copy(SAMPLE_CSV, path)
+    return path
+
+
+@pytest.fixture
+def dashboard_csv(tmp_path, monkeypatch):
+    # The sample CSV where main.py reads its data, in a scratch working directory
+    from core.store import DASHBOARD_DATA
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.dirname(DASHBOARD_DATA))
+    shutil.copy(SAMPLE_CSV, DASHBOARD_DATA)
+    return DASHBOARD_DATA
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from core.forecast import TRAINING_PERCENTAGES
+from core.jobs import JobQueue, computed_job, forecast_jobs, forecast_results
+
+# Seconds a test waits for a worker before failing
+TIMEOUT = 120
+
+
+def start_and_sleep(marker, seconds):
+    # A long fit that signals once it is running in the worker
+    open(marker, "w").close()
+    time.sleep(seconds)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_superseding_a_running_job_stops_its_worker(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = JobQueue(1)
+    try:
+        marker = tmp_path / "started"
+        job = queue.submit('session', {'kind': 'sleep'}, start_and_sleep, str(marker), 600)
+        wait_for(marker.exists)
+        assert job.state == 'running'
+
+        started = time.monotonic()
+        queue.supersede('session', [])
+        wait_for(lambda: job.state == 'cancelled')
+        assert time.monotonic() - started < 30
+
+        # The stopped worker is replaced, so the pool keeps running jobs
+        next_job = queue.submit('session', {'kind': 'sum'}, sum, [1, 2])
+        assert next_job.future.result(timeout=TIMEOUT) == 3
+    finally:
+        queue.shutdown()
+
+
+def test_a_running_job_another_owner_wants_keeps_running(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = JobQueue(1)
+    try:
+        marker = tmp_path / "started"
+        job = queue.submit('first', {'kind': 'sleep'}, start_and_sleep, str(marker), 1)
+        queue.submit('second', {'kind': 'sleep'}, start_and_sleep, str(marker), 1)
+        wait_for(marker.exists)
+        queue.supersede('first', [])
+        assert job.future.result(timeout=TIMEOUT) is None
+        assert job.state == 'done'
+    finally:
+        queue.shutdown()
+
+
+def backtest(percentage):
+    if percentage < 0.5:
+        raise ValueError("Not enough data to backtest this split")
+    if percentage > 0.8:
+        raise RuntimeError("fit diverged")
+    return {'MAE': percentage}, None
+
+
+def test_forecast_results_use_the_stored_result_before_computing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stored = {'forecast': 'stored forecast', 'backtests': {0.9: 'stored backtest'}}
+    tasks = {
+        percentage: ({'kind': 'backtest', 'train_percentage': percentage}, (backtest, percentage), None)
+        for percentage in TRAINING_PERCENTAGES
+    }
+    forecast_job, backtest_jobs = forecast_jobs(computed_job, stored, ({'kind': 'forecast'}, (dict,), None), tasks)
+    assert forecast_job is None
+    assert sorted(backtest_jobs) == [0.3, 0.5, 0.7]
+
+    forecast, backtests = forecast_results(stored, forecast_job, backtest_jobs)
+    assert forecast == 'stored forecast'
+    assert backtests == {0.3: None, 0.5: ({'MAE': 0.5}, None), 0.7: ({'MAE': 0.7}, None), 0.9: 'stored backtest'}
+
+    # Only a split without enough data is skipped; any other failure is an error
+    with pytest.raises(RuntimeError):
+        forecast_jobs(computed_job, None, ({'kind': 'forecast'}, (dict,), None), tasks)
@@ -0,0 +1,51 @@
+import gc
+import pickle
+import tracemalloc
+
+import pandas as pd
+
+from core import compute
+from core.cube import open_cube
+from core.store import ensure_store, open_store
+
+# How many times less the compact dataset and a rerun must take than the plain pandas load
+MIN_SCHEMA_RATIO = 3
+MIN_RERUN_RATIO = 4
+
+
+def traced_peak(function):
+    # Peak bytes allocated by function, as tracemalloc sees them
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_compact_schema_holds_rows_in_a_fraction_of_the_pandas_frame(sample_csv):
+    baseline = pd.read_csv(sample_csv).memory_usage(deep=True).sum()
+    # Copied to the heap, so mapped columns count in full
+    compact = open_store(ensure_store(sample_csv)).copy().memory_usage(deep=True).sum()
+    assert baseline / compact >= MIN_SCHEMA_RATIO
+
+
+def test_rerun_peak_memory_is_several_times_lower(sample_csv):
+    path = ensure_store(sample_csv)
+    # Before the cube, st.cache_data handed every rerun its own unpickled copy of the CSV frame and
+    # each tab copied it again before parsing dates
+    cached = pickle.dumps(pd.read_csv(sample_csv))
+
+    def pandas_rerun():
+        frame = pickle.loads(cached).copy()
+        frame['Date'] = pd.to_datetime(frame['Date'], errors='coerce')
+        frame['Month'] = frame['Date'].dt.to_period('M').astype(str)
+
+    def cube_rerun():
+        cube = open_cube(path)
+        cities = list(cube.cities)
+        compute.monthly_api_box(cube, cities)
+        compute.monthly_api(cube, cities)
+
+    assert traced_peak(pandas_rerun) / traced_peak(cube_rerun) >= MIN_RERUN_RATIO
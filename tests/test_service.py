@@ -0,0 +1,28 @@
+import json
+
+from core import service as service_module
+from core.cube import open_cube
+from core.memory import freeze
+from core.service import QueryService
+
+
+def test_a_response_matches_the_etag_of_its_cube(sample_csv, monkeypatch):
+    query_service = QueryService(sample_csv, workers=1, filters=None)
+    try:
+        first = query_service.refresh()
+
+        def version_after_refresh(service, cube, params):
+            # A refresh swaps the cube while the response is being computed
+            service.cube = freeze(open_cube(service.path))
+            service.cube.version = ('next',)
+            return list(cube.version)
+
+        monkeypatch.setitem(service_module.ENDPOINTS, '/version', version_after_refresh)
+        etag, body, version = query_service.query('/version', {})
+        assert json.loads(body) == list(first.version)
+        assert version == first.version
+        assert etag == query_service.etag(first, '/version', {})
+        assert query_service.pending == {}
+        assert query_service.responses[etag] == body
+    finally:
+        query_service.queue.shutdown()
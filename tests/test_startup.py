@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.startup import DEFERRED_MODULES, REPO_DIR, STARTUP_BUDGET, child_environment, measure_startup
+from benchmarks.synthetic_data import TEMPLATE_PATH
+
+# Runs in a fresh interpreter, so modules imported by other tests do not count
+IMPORT_MAIN = "import json, sys; import main; print(json.dumps(sorted(sys.modules)))"
+
+
+def test_importing_main_loads_no_forecasting_library(dashboard_csv):
+    completed = subprocess.run(
+        [sys.executable, "-c", IMPORT_MAIN], capture_output=True, text=True, env=child_environment(), check=True
+    )
+    modules = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert sorted({module.split('.')[0] for module in modules} & set(DEFERRED_MODULES)) == []
+
+
+def test_first_render_is_within_the_cold_start_budget():
+    result = measure_startup(os.path.join(REPO_DIR, TEMPLATE_PATH), runs=3)
+    assert result['exceptions'] == []
+    assert result['deferred_loaded'] == []
+    assert result['startup_seconds'] <= STARTUP_BUDGET, (
+        f"Cold start took {result['startup_seconds']:.2f} s, over the {STARTUP_BUDGET:.2f} s budget"
+    )
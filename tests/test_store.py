@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+
+import pandas as pd
+
+from core.cube import open_cube
+from core.store import ensure_store, read_meta, store_path
+
+APPENDING_PROCESSES = 4
+
+
+def test_concurrent_appends_match_a_full_ingest(sample_csv):
+    # The newest rows arrive at the end of the CSV while several processes bring the store up to date
+    rows = pd.read_csv(sample_csv).sort_values('Date', kind='stable')
+    dates = rows['Date'].drop_duplicates()
+    cutoff = dates.iloc[int(len(dates) * 0.7)]
+    rows[rows['Date'] < cutoff].to_csv(sample_csv, index=False)
+    ensure_store(sample_csv)
+    rows[rows['Date'] >= cutoff].to_csv(sample_csv, mode='a', header=False, index=False)
+
+    with multiprocessing.get_context('spawn').Pool(APPENDING_PROCESSES) as pool:
+        paths = pool.map(ensure_store, [sample_csv] * APPENDING_PROCESSES)
+    assert set(paths) == {store_path(sample_csv)}
+
+    full_csv = os.path.join("data", "full.csv")
+    rows.to_csv(full_csv, index=False)
+    appended, full = open_cube(ensure_store(sample_csv)), open_cube(ensure_store(full_csv))
+    meta = read_meta(store_path(sample_csv))
+    assert meta['rows'] == len(rows)
+    for column, dtype in (('Date', 8), ('median', 4)):
+        assert os.path.getsize(os.path.join(store_path(sample_csv), f"{column}.bin")) == meta['rows'] * dtype
+    pd.testing.assert_frame_equal(appended.rollups.monthly(None, 'api'), full.rollups.monthly(None, 'api'))